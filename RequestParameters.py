@@ -1,98 +1,583 @@
+import email.message
+import email.parser
+import email.utils
+import hashlib
+import io
+import os
+import tempfile
 import urllib.parse as parse
+import uuid
+from functools import cached_property
 from general import isEmpty
-import multipart
+from httpcompression import parse_accept_encoding_header, negotiate_encoding
 import json
 
+MAX_QUERY_FIELDS = 256
+MAX_COOKIES = 64
+
+
+def splitpath(path: str) -> list[str]:
+    """
+    Split the path of a request target into its unquoted, non-empty segments.
+
+    Query string and fragment are dropped, empty segments ('//', trailing '/') are skipped.
+    """
+    path = path.split('?', 1)[0].split('#', 1)[0]
+    return [parse.unquote(item) for item in path.split('/') if item.strip() != '']
+
+
+class RequestView:
+    """
+    Lazily parsed view of a request.
+
+    Every attribute is parsed on first access and cached, requests never touching
+    the query string or cookies never parse them. Parsing is linear in the size of
+    the input, at most MAX_QUERY_FIELDS query fields and MAX_COOKIES cookies are read,
+    malformed fields and cookies are skipped.
+
+    Args:
+        target (str): the request target as sent by the client, e.g. '/files/a%20b?x=1'.
+        headers: the request headers (email.message.Message).
+    """
+    def __init__(self, target: str, headers):
+        self.target = target
+        self.headers = headers
+
+    @cached_property
+    def path(self) -> str:
+        """the target without query string and fragment, still quoted"""
+        return self.target.split('#', 1)[0].split('?', 1)[0]
+
+    @cached_property
+    def query_string(self) -> str:
+        return self.target.split('#', 1)[0].partition('?')[2]
+
+    @cached_property
+    def segments(self) -> list[str]:
+        """the unquoted path segments, see splitpath"""
+        return splitpath(self.path)
+
+    @cached_property
+    def query(self) -> dict[str, list[str]]:
+        """the decoded query parameters, each with the list of all its values in order"""
+        query = {}
+        fields = self.query_string.split('&', MAX_QUERY_FIELDS)[:MAX_QUERY_FIELDS]
+        for key, value in parse.parse_qsl('&'.join(fields), keep_blank_values=True):
+            query.setdefault(key, []).append(value)
+        return query
+
+    def query_value(self, key: str, default: str = None) -> str:
+        """the first value of the query parameter key"""
+        values = self.query.get(key)
+        return values[0] if values else default
+
+    @cached_property
+    def cookies(self) -> dict[str, str]:
+        """the cookies of all Cookie headers, the first of several equal names wins"""
+        cookies = {}
+        for header in self.headers.get_all('Cookie') or ():
+            for pair in header.split(';', MAX_COOKIES)[:MAX_COOKIES]:
+                name, sep, value = pair.partition('=')
+                name = name.strip()
+                if not sep or not name or name in cookies or len(cookies) >= MAX_COOKIES:
+                    continue
+                value = value.strip()
+                if len(value) >= 2 and value[0] == value[-1] == '"':
+                    value = value[1:-1]
+                cookies[name] = parse.unquote(value)
+        return cookies
+
+    @cached_property
+    def accept_encodings(self) -> list[str]:
+        """the parsed Accept-Encoding header, empty if the header is missing"""
+        if 'Accept-Encoding' not in self.headers:
+            return []
+        return parse_accept_encoding_header(self.headers['Accept-Encoding'])
+
+    @cached_property
+    def encoding(self) -> str:
+        """the content encoding negotiated from Accept-Encoding, see httpcompression.negotiate_encoding"""
+        if 'Accept-Encoding' not in self.headers:
+            return 'identity'
+        return negotiate_encoding(self.accept_encodings)
+
+
 def _readonly(self, *args, **kwargs):
     raise RuntimeError("Cannot modify ReadOnlyDictionary")
 
 
-class FakeMultipartParser(multipart.MultipartParser):
-    def __init__(
-        self,
-        stream,
-        content_length=-1,
-        disk_limit=2 ** 30,
-        mem_limit=2 ** 20,
-        memfile_limit=2 ** 18,
-        buffer_size=2 ** 16,
-        charset='latin1'
-    ):
-        """ Parse a application/x-www-form-urlencoded byte stream. This object is an iterator
-            over the parts of the message.
-            :param stream: A file-like stream. Must implement ``.read(size)``.
-            :param boundary: The multipart boundary as a byte string.
-            :param content_length: The maximum number of bytes to read.
+class BodyTooLarge(ValueError):
+    """the request body exceeds a configured limit, answered with 413"""
+
+
+class MalformedBody(ValueError):
+    """the request body can not be read or parsed, answered with 400"""
+
+
+class MultipartError(MalformedBody):
+    """the multipart body is malformed, answered with 400"""
+
+
+class UnsupportedMediaType(ValueError):
+    """process_request can not parse the Content-Type, answered with 415"""
+
+
+class BodyReader:
+    """
+    File-like reader returning the body of a request from rfile, and nothing beyond it.
+
+    Bodies are either delimited by Content-Length (length) or sent with
+    Transfer-Encoding: chunked, which is decoded on the fly. Keeps track of how
+    much of the body is left, so the rest can be skipped before the next request
+    on a persistent connection is read.
+
+    Args:
+        rfile: the input stream of the connection.
+        length (int): the Content-Length, ignored for chunked bodies.
+        chunked (bool): the body uses chunked transfer encoding.
+        limit (int): reading more than limit bytes raises BodyTooLarge, None for no limit.
+        on_data (callable): called without arguments whenever body data was read.
+    """
+    max_line = 4096
+
+    def __init__(self, rfile, length: int = 0, *, chunked: bool = False, limit: int = None, on_data=None):
+        self.rfile = rfile
+        self.on_data = on_data
+        self.chunked = chunked
+        self.length = None if chunked else max(0, int(length))
+        self.remaining = None if chunked else self.length
+        self.limit = limit
+        self.received = 0
+        self._chunk_left = 0
+        self._done = not chunked and self.length == 0
+        if self.length is not None and limit is not None and self.length > limit:
+            raise BodyTooLarge(f"request body larger than {limit} bytes")
+
+    @property
+    def done(self) -> bool:
+        """True once the whole body was read"""
+        return self._done
+
+    def _count(self, data: bytes) -> bytes:
+        self.received += len(data)
+        if self.on_data is not None:
+            self.on_data()
+        if self.limit is not None and self.received > self.limit:
+            raise BodyTooLarge(f"request body larger than {self.limit} bytes")
+        return data
+
+    def _next_chunk(self) -> bool:
+        """read the next chunk size line, False after the last chunk and its trailers"""
+        line = self.rfile.readline(self.max_line)
+        if not line.endswith(b'\n'):
+            raise MalformedBody("malformed chunk size line")
+        try:
+            self._chunk_left = int(line.split(b';', 1)[0].strip(), 16)
+        except ValueError:
+            raise MalformedBody("malformed chunk size line")
+        if self._chunk_left < 0:
+            raise MalformedBody("malformed chunk size line")
+        if self._chunk_left > 0:
+            return True
+        for _ in range(100):
+            # trailer fields are ignored
+            line = self.rfile.readline(self.max_line)
+            if line in (b'\r\n', b'\n', b''):
+                self._done = True
+                return False
+        raise MalformedBody("too many trailer fields")
+
+    def _end_chunk(self):
+        if self.rfile.readline(3) not in (b'\r\n', b'\n'):
+            raise MalformedBody("chunk not terminated by a line break")
+
+    def _read_chunked(self, size: int, line: bool = False) -> bytes:
+        if self._done or size == 0:
+            return b''
+        if self._chunk_left == 0 and not self._next_chunk():
+            return b''
+        size = self._chunk_left if size < 0 else min(size, self._chunk_left)
+        data = self.rfile.readline(size) if line else self.rfile.read(size)
+        if not data:
+            raise MalformedBody("unexpected end of chunked body")
+        self._chunk_left -= len(data)
+        if self._chunk_left == 0:
+            self._end_chunk()
+        return self._count(data)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None:
+            size = -1
+        if self.chunked:
+            if size >= 0:
+                return self._read_chunked(size)
+            parts = []
+            while data := self._read_chunked(2 ** 16):
+                parts.append(data)
+            return b''.join(parts)
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        if size == 0:
+            return b''
+        data = self.rfile.read(size)
+        self.remaining -= len(data)
+        if not data:
+            self.remaining = 0
+        self._done = self.remaining == 0
+        return self._count(data)
+
+    def readline(self, size: int = -1) -> bytes:
+        if size is None:
+            size = -1
+        if self.chunked:
+            return self._read_chunked(size, line=True)
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        if size == 0:
+            return b''
+        data = self.rfile.readline(size)
+        self.remaining -= len(data)
+        if not data:
+            self.remaining = 0
+        self._done = self.remaining == 0
+        return self._count(data)
+
+    def iter_chunks(self, size: int = 2 ** 16):
+        """yield the rest of the body in pieces of at most size bytes"""
+        while data := self.read(size):
+            yield data
+
+    def discard(self, limit: int = 2 ** 16) -> bool:
         """
+        Read and drop the rest of the body without keeping it.
 
+        Args:
+            limit (int): the maximum number of bytes to skip.
+
+        Returns:
+            True if the whole body was consumed, False if more than limit bytes were left
+            or the body was malformed, the connection can not be reused then.
+        """
+        if self.remaining is not None and self.remaining > limit:
+            return False
+        self.limit = None
+        skipped = 0
+        try:
+            while not self._done and skipped <= limit:
+                data = self.read(min(limit + 1 - skipped, 2 ** 16))
+                if not data:
+                    break
+                skipped += len(data)
+        except (MalformedBody, OSError):
+            return False
+        return self._done and skipped <= limit
+
+
+class FormPart:
+    """
+    A field or uploaded file of a form.
+
+    Fields are kept in memory, files are written to a temporary file (path)
+    while the body is read and have to be moved to their destination with save_as,
+    otherwise they are removed by FormData.cleanup. The SHA-256 hex digest of
+    files (sha256) is computed while they are written.
+    """
+    def __init__(self, name: str, filename: str = None, content_type: str = 'text/plain',
+                 charset: str = 'UTF-8', headers: email.message.Message = None):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.charset = charset
+        self.headers = headers
+        self.size = 0
+        self.path = None
+        self.sha256 = None
+        self._data = bytearray()
+        self._saved = False
+
+    @property
+    def is_file(self) -> bool:
+        return self.path is not None
+
+    @property
+    def raw(self) -> bytes:
+        """the content as bytes, files are read from disk"""
+        if self.path is None:
+            return bytes(self._data)
+        with open(self.path, 'rb') as byte_file:
+            return byte_file.read()
+
+    @property
+    def value(self) -> str:
+        return self.raw.decode(self.charset, 'replace')
+
+    def open(self):
+        """the content as a binary file object"""
+        if self.path is None:
+            return io.BytesIO(self._data)
+        return open(self.path, 'rb')
+
+    def save_as(self, path: str):
+        """store the content at path, uploaded files are renamed atomically"""
+        if self.path is None:
+            with open(path, 'wb') as byte_file:
+                byte_file.write(self._data)
+            return
+        os.replace(self.path, path)
+        self.path = path
+        self._saved = True
+
+    def cleanup(self):
+        """remove the temporary file, unless it was saved"""
+        if self.path is not None and not self._saved:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+
+class FormData:
+    """
+    The parts of a form, looked up by field name.
+
+    Supports the part lookups addons used on multipart.MultipartParser (get, get_all, iteration).
+    """
+    def __init__(self, parts: list[FormPart] = None):
+        self.parts = parts or []
+
+    def __iter__(self):
+        return iter(self.parts)
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def get(self, name: str, default=None) -> FormPart:
+        """the first part called name"""
+        for part in self.parts:
+            if part.name == name:
+                return part
+        return default
+
+    def get_all(self, name: str) -> list[FormPart]:
+        return [part for part in self.parts if part.name == name]
+
+    def cleanup(self):
+        """remove the temporary files of all uploads that were not saved"""
+        for part in self.parts:
+            part.cleanup()
+
+
+class MultipartReader:
+    """
+    Incremental multipart/form-data parser.
+
+    The body is read in chunks of chunk_size bytes, uploaded files are written to
+    temporary files in spool_dir as their data arrives, so memory use does not depend
+    on the size of the uploads. Fields without filename are kept in memory.
+
+    Args:
+        stream: file-like object returning the body, e.g. a BodyReader.
+        boundary (str): the boundary parameter of the Content-Type.
+        spool_dir (str): directory of the temporary upload files, should be on the
+            file system of their destination so save_as only renames them.
+        memory_limit (int): the maximum summed size of all fields kept in memory.
+        max_parts (int): the maximum number of parts.
+        charset (str): the charset of fields without own charset.
+    """
+    max_header_size = 2 ** 14
+
+    def __init__(self, stream, boundary: str, *, spool_dir: str = None, memory_limit: int = 2 ** 20,
+                 max_parts: int = 128, charset: str = 'UTF-8', chunk_size: int = 2 ** 16):
+        if not boundary or len(boundary) > 200:
+            raise MultipartError("invalid multipart boundary")
         self.stream = stream
-        self.content_length = content_length
-        self.disk_limit = disk_limit
-        self.memfile_limit = memfile_limit
-        self.mem_limit = min(mem_limit, self.disk_limit)
-        self.buffer_size = min(buffer_size, self.mem_limit)
+        self.delimiter = b'\r\n--' + boundary.encode('latin-1')
+        self.spool_dir = spool_dir
+        self.memory_limit = memory_limit
+        self.max_parts = max_parts
         self.charset = charset
+        self.chunk_size = chunk_size
+        # the delimiter starts with a line break, which the first boundary line lacks
+        self._buffer = bytearray(b'\r\n')
 
-        if self.buffer_size - 6 < 1:
-            raise multipart.MultipartError("Boundary does not fit into buffer_size.")
+    def _fill(self) -> bool:
+        data = self.stream.read(self.chunk_size)
+        if not data:
+            return False
+        self._buffer += data
+        return True
 
-        self._done = []
-        self._part_iter = None
+    def _read_until(self, marker: bytes, limit: int) -> bytes:
+        while True:
+            index = self._buffer.find(marker)
+            if index > limit:
+                raise MultipartError("multipart header too long")
+            if index >= 0:
+                data = bytes(self._buffer[:index])
+                del self._buffer[:index + len(marker)]
+                return data
+            if len(self._buffer) > limit:
+                raise MultipartError("multipart header too long")
+            if not self._fill():
+                raise MultipartError("unexpected end of multipart body")
 
-    def _iterparse(self):
-        opts = {
-            "buffer_size": self.buffer_size,
-            "memfile_limit": self.memfile_limit,
-            "charset": self.charset,
-        }
+    def _data_chunks(self):
+        """yield the data of the current part up to the next delimiter"""
+        delimiter = self.delimiter
+        keep = len(delimiter) - 1
+        while True:
+            index = self._buffer.find(delimiter)
+            if index >= 0:
+                if index:
+                    yield bytes(self._buffer[:index])
+                del self._buffer[:index + len(delimiter)]
+                return
+            if len(self._buffer) > keep:
+                # the end of the buffer may be the start of a delimiter
+                yield bytes(self._buffer[:-keep])
+                del self._buffer[:-keep]
+            if not self._fill():
+                raise MultipartError("unexpected end of multipart body")
 
-        for key, value in parse.parse_qsl(self.stream.read(self.content_length)):
-            part = multipart.MultipartPart(**opts)
-            part.feed(multipart.to_bytes(F"Content-Disposition: form-data; name=\"{key}\"", self.charset), '\n')
-            part.feed(b'', '\n')
-            part.feed(multipart.to_bytes(value, self.charset), '\n')
-            yield part
+    def _next_part(self) -> bool:
+        """consume the rest of the delimiter line, False after the closing delimiter"""
+        while len(self._buffer) < 2:
+            if not self._fill():
+                raise MultipartError("unexpected end of multipart body")
+        if self._buffer[:2] == b'--':
+            return False
+        # transport padding may follow the boundary
+        padding = self._read_until(b'\r\n', self.max_header_size)
+        if padding.strip(b' \t'):
+            raise MultipartError("malformed multipart boundary line")
+        return True
 
-    def parts(self):
-        """ Returns a list with all parts of the multipart message. """
-        return list(self)
+    def _read_headers(self) -> email.message.Message:
+        while len(self._buffer) < 2:
+            if not self._fill():
+                raise MultipartError("unexpected end of multipart body")
+        if self._buffer[:2] == b'\r\n':
+            # a part without headers
+            del self._buffer[:2]
+            head = b''
+        else:
+            head = self._read_until(b'\r\n\r\n', self.max_header_size)
+        return email.parser.BytesHeaderParser().parsebytes(head)
 
+    def parse(self) -> FormData:
+        """
+        Read the whole body.
 
-def process_request(content_type: bytes, rfile, content_length: int = -1, charset: str = 'UTF-8') -> multipart.MultipartParser:
+        Raises:
+            MultipartError: if the body is malformed.
+            BodyTooLarge: if there are too many parts or fields exceed memory_limit.
+        """
+        form = FormData()
+        memory = 0
+        try:
+            for _ in self._data_chunks():
+                pass  # preamble
+            while self._next_part():
+                if len(form.parts) >= self.max_parts:
+                    raise BodyTooLarge(f"more than {self.max_parts} parts")
+                headers = self._read_headers()
+                filename = headers.get_filename()
+                name = headers.get_param('name', header='content-disposition')
+                part = FormPart(
+                    email.utils.collapse_rfc2231_value(name) if name is not None else None,
+                    filename,
+                    headers.get_content_type() if 'Content-Type' in headers else (
+                        'application/octet-stream' if filename is not None else 'text/plain'),
+                    headers.get_content_charset() or self.charset,
+                    headers
+                    )
+                form.parts.append(part)
+                if filename is None:
+                    for data in self._data_chunks():
+                        part.size += len(data)
+                        memory += len(data)
+                        if memory > self.memory_limit:
+                            raise BodyTooLarge(f"form fields larger than {self.memory_limit} bytes")
+                        part._data += data
+                    continue
+                # not tempfile, the file gets the permissions of a normally created file
+                part.path = os.path.join(self.spool_dir or tempfile.gettempdir(), f".upload-{uuid.uuid4().hex}.tmp")
+                digest = hashlib.sha256()
+                with open(part.path, 'xb') as spool:
+                    for data in self._data_chunks():
+                        part.size += len(data)
+                        digest.update(data)
+                        spool.write(data)
+                part.sha256 = digest.hexdigest()
+        except BaseException:
+            form.cleanup()
+            raise
+        return form
+
+
+def process_request(content_type: str, rfile, content_length: int = -1, charset: str = 'UTF-8', *,
+                    spool_dir: str = None, memory_limit: int = 2 ** 20, max_parts: int = 128):
+    """
+    Parse a request body according to its Content-Type.
+
+    Args:
+        content_type (str): the Content-Type header.
+        rfile: file-like object returning the body and nothing beyond it, e.g. a BodyReader
+            with a limit, JSON documents are read from it as a whole.
+        content_length (int): the length of the body, -1 if unknown (chunked).
+        charset (str): the default charset.
+        spool_dir (str): directory for the temporary files of uploads, see MultipartReader.
+        memory_limit (int): the maximum size of the form fields kept in memory.
+        max_parts (int): the maximum number of form fields.
+
+    Returns:
+        FormData for multipart/form-data and application/x-www-form-urlencoded bodies,
+        the decoded document for application/json, None without Content-Type.
+
+    Raises:
+        BodyTooLarge: if the form exceeds memory_limit or max_parts.
+        MalformedBody: if the body can not be parsed.
+        UnsupportedMediaType: for other content types, the body is left unread.
+    """
     if isEmpty(content_type):
         return
-    content_type = content_type.strip()
+    header = email.message.Message()
+    header['Content-Type'] = content_type.strip()
+    content_type = header.get_content_type()
+    charset = header.get_content_charset() or charset
     req = None
-    if content_type.split(';')[0] == 'multipart/form-data':
-        i = 1
-        boundary = content_type.split(';')[i].strip()
-        while not boundary.startswith('boundary='):
-            print(boundary)
-            i += 1
-            print(i)
-            boundary = content_type.split(';')[i].strip()
-        boundary = boundary.replace('boundary=', '', 1)
-
-        req = multipart.MultipartParser(
+    if content_type == 'multipart/form-data':
+        req = MultipartReader(
             rfile,
-            boundary,
-            int(content_length),
-            charset="UTF-8"
-            )
+            header.get_param('boundary'),
+            spool_dir=spool_dir,
+            memory_limit=memory_limit,
+            max_parts=max_parts,
+            charset=charset
+            ).parse()
 
     elif content_type == 'application/x-www-form-urlencoded':
-        req = FakeMultipartParser(
-            rfile,
-            int(content_length),
-            charset="UTF-8"
-            )
+        fields = rfile.read(content_length if 0 <= content_length <= memory_limit else memory_limit + 1)
+        if len(fields) > memory_limit:
+            raise BodyTooLarge(f"form fields larger than {memory_limit} bytes")
+        req = FormData()
+        fields = fields.decode(charset, 'replace')
+        try:
+            fields = parse.parse_qsl(fields, keep_blank_values=True, max_num_fields=max_parts)
+        except ValueError:
+            raise BodyTooLarge(f"more than {max_parts} form fields")
+        for key, value in fields:
+            part = FormPart(key, charset=charset)
+            part._data += value.encode(charset)
+            part.size = len(part._data)
+            req.parts.append(part)
     elif content_type == 'application/json':
-        string = rfile.read(content_length).decode(charset)
-        req = json.loads(string)
-    else:
+        data = rfile.read(content_length)
         try:
-            print(rfile.read(content_length))
-        except Exception as e:
-            print(e)
-        raise NotImplementedError("cant handle type " + content_type)
+            req = json.loads(data if charset.lower() in ('utf-8', 'utf8') else data.decode(charset))
+        except (UnicodeDecodeError, ValueError) as e:
+            raise MalformedBody(f"invalid JSON: {e}")
+    else:
+        raise UnsupportedMediaType("cant handle type " + content_type)
     return req
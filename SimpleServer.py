@@ -1,18 +1,33 @@
 import http.server as http
 import os
+import stat
+import errno
+import select
+import uuid
 import urllib.parse as parse
-import ssl
-import multiprocessing
-import requests
-from time import sleep
-from typing import Any, List
-import subprocess
-import gzip
-import zlib
+import socket
+import hmac
+import json
+import threading
 import functools
+from time import monotonic
+from typing import Any
 
 import RequestParameters
-from general import Settings
+# splitpath is still importable from here, it moved to RequestParameters
+from RequestParameters import RequestView, splitpath
+from general import Settings, load_templates
+from threadpool import ThreadPoolHTTPServer
+from supervisor import Supervisor, on_drain, request_reload, start_heartbeat, PROBE_AGENT
+from routing import Router
+from response import HeaderMap, build_response
+from logwriter import LogWriter, get_log_writer, close_log_writers
+from caching import StaticFileCache, ByteLRUCache, ValidatorIndex, etag_matches, not_modified_since, if_range_matches
+# parse_accept_encoding_header and negotiate_encoding are re-exported, they used to live here
+from httpcompression import (
+    compress_data, find_precompressed, CompressionPolicy, StreamCompressor,
+    parse_accept_encoding_header, negotiate_encoding
+    )
 import importlib
 try:
     import addons
@@ -20,124 +35,218 @@ except ImportError as ie:
     print("WARNING Unable to import addons, no custom functionality is available", ie)
 
 
-def splitpath(path: str) -> list[str]:
-    path = path.split('?')[0].split('#')[0]
-    while '//' in path:
-        path.replace('//', '/')
-    pathlist_a = path.split('/')
-    pathlist_b = []
-    for item in pathlist_a:
-        if item.strip() != '':
-            pathlist_b.append(parse.unquote(item))
-    return pathlist_b
-
-
-@functools.cache
-def parse_accept_encoding_header(header: str) -> List[str]:
+def parse_range_header(header: str, size: int, max_ranges: int = 16):
     """
-    Parse the given Accept-Encoding header string and return a list of
-    encodings ordered by their qvalues weighting.
+    Parse a Range header for a file of size bytes.
 
     Args:
-        header (str): The Accept-Encoding header string.
+        header (str): the Range header, e.g. 'bytes=0-499, -500'.
+        size (int): the size of the file.
+        max_ranges (int): headers with more ranges are ignored.
 
     Returns:
-        A list of encoding names ordered by their qvalues.
-
-    Example:
-        >>> header = 'gzip, deflate;q=0.5, br;q=0.1'
-        >>> parse_accept_encoding(header)
-        ['gzip', 'deflate', 'br']
-    """
-    encodings = [('identity', 0.01)]  # A list of encoding names with their qvalues
-    if header:
-        parts = header.split(',')
-        for part in parts:
-            encoding, _, params = part.strip().partition(';')
-            qvalue = 1.0
-            for param in params.split(';'):
-                key, _, value = param.strip().partition('=')
-                if key == 'q':
-                    qvalue = float(value)
-            encodings.append((encoding, qvalue))
-    encodings.sort(key=lambda x: x[1], reverse=True)
-    return [encoding for encoding, _ in encodings]
-
-
-def compress_data(data: bytes, encodings: List[str] = ['identity',]) -> tuple[bytes, str]:
+        None if the header should be ignored (malformed, other unit, too many ranges),
+        otherwise a list of (start, end) tuples with inclusive ends, which is empty
+        if none of the ranges is satisfiable.
     """
-    Compress the given bytes object using the specified encoding.
-
-    Args:
-        data (bytes): The bytes object to compress.
-        encodings (List of str): The parsed Accept-Encoding header sent by the client.
-
-    Returns:
-        The compressed bytes object.
-    """
-    # Compress the data using the first available encoding
-    for encoding in encodings:
-        if encoding == 'gzip' or encoding == '*':
-            return gzip.compress(data, compresslevel=9), 'gzip'
-        elif encoding == 'compress':
-            return zlib.compress(data, level=9), 'compress'
-        elif encoding == 'deflate':
-            compressobj = zlib.compressobj(level=9, method=zlib.DEFLATED, wbits=15)
-            compressed = compressobj.compress(data) + compressobj.flush()  # compress the data using Deflate
-            return compressed, 'deflate'
-        elif encoding == 'identity':
-            return data, 'identity'
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    specs = specs.split(',')
+    if len(specs) > max_ranges:
+        return None
+    ranges = []
+    for spec in specs:
+        first, dash, last = spec.strip().partition('-')
+        first, last = first.strip(), last.strip()
+        if dash != '-' or (first == '' and last == ''):
+            return None
+        for number in (first, last):
+            if number != '' and not (number.isascii() and number.isdigit()):
+                return None
+        if first == '':
+            start, end = max(0, size - int(last)), size - 1
+            if int(last) == 0:
+                continue
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last != '' else size - 1
+            if last != '' and int(last) < start:
+                return None
+        if start < size:
+            ranges.append((start, end))
+    return ranges
 
 
 class SimpleServer(http.SimpleHTTPRequestHandler):  # eine Klasse 'Server' erstellen, diese wird dem http modul übergeben
     pathlist = None
-    __headers = None
+    rawpath = None
+    _view = None
+    _postdata = None
+    body = None
+    page_capture = None
+    response_headers = None
+    headers_sent = False
+    requests_handled = 0
+    chunk_size = 2 ** 16
+    single_write_limit = 2 ** 16
+    parked = False
+    _head_routed = False
+
+    def setup(self):
+        """
+        Apply the keep-alive idle timeout to the connection before the first request is read.
+        """
+        self.timeout = settings('keep alive timeout', 15)
+        super().setup()
+
+    def handle(self):
+        """
+        Handle requests until the connection is closed.
+
+        Servers that support it (ThreadPoolHTTPServer.park) get idle keep-alive connections
+        back between two requests, so waiting for the next request does not hold a thread.
+        handle is called again once the next request arrives.
+        """
+        self.parked = False
+        self.close_connection = True
+        self.handle_one_request()
+        park = getattr(self.server, 'park', None)
+        while not self.close_connection:
+            if park is not None and not self.input_pending() and park(self):
+                self.parked = True
+                return
+            self.handle_one_request()
+
+    def input_pending(self) -> bool:
+        """True if the next request (e.g. pipelined) is already buffered or readable without waiting"""
+        timeout = self.connection.gettimeout()
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            # nothing to read yet, e.g. ssl.SSLWantReadError
+            return False
+        finally:
+            self.connection.settimeout(timeout)
+
+    def finish(self):
+        # a parked connection keeps its files for the next call of handle
+        if self.parked:
+            self.wfile.flush()
+            return
+        super().finish()
 
     def handle_one_request(self, *args, **kargs):
         """
         Add custom headers and call the super method.
 
-        Initializes the __headers attribute to an empty list, then calls
+        Initializes the response_headers attribute to an empty HeaderMap, then calls
         the handle_one_request method of the superclass with the provided
         arguments and keyword arguments.
+        Persistent HTTP/1.1 connections are used unless 'keep alive' is disabled in the settings.
+        Changed settings files are applied before the request, see refresh_settings.
+        The request counts as active from its parsing until it was handled, see longest_stall.
 
         Returns:
             The return value of the superclass's handle_one_request method.
         """
-        self.__headers = []
-        return super().handle_one_request(*args, **kargs)
+        self.response_headers = HeaderMap()
+        self.headers_sent = False
+        self.pathlist = None
+        self.rawpath = None
+        self._view = None
+        self._postdata = None
+        self._head_routed = False
+        self.body = None
+        self.requests_handled += 1
+        refresh_settings()
+        if settings('keep alive', True) and getattr(self.server, 'persistent_connections', True):
+            self.protocol_version = 'HTTP/1.1'
+        else:
+            self.protocol_version = 'HTTP/1.0'
+        try:
+            return super().handle_one_request(*args, **kargs)
+        finally:
+            active_requests.pop(threading.get_ident(), None)
+
+    def parse_request(self) -> bool:
+        """parse the request line and headers, and register the request as active if they are valid"""
+        if not super().parse_request():
+            return False
+        active_requests[threading.get_ident()] = monotonic()
+        return True
+
+    @property
+    def view(self) -> RequestView:
+        """
+        The lazily parsed request: path segments, query parameters, cookies and
+        the negotiated content encoding, see RequestParameters.RequestView.
+        """
+        if self._view is None:
+            self._view = RequestView(self.rawpath or self.path, self.headers)
+        return self._view
 
     def send_header(self, keyword, value) -> None:
         """
         Add a custom header to the response.
 
         Overrides the send_header method of the superclass to add
-        the specified header to the internal __headers list instead
+        the specified header to the response_headers map instead
         of writing it to the output stream.
 
         Args:
             keyword (str): The name of the header.
             value (str): The value of the header.
         """
-        if self.__headers is None:
-            self.__headers = []
+        if self.response_headers is None:
+            self.response_headers = HeaderMap()
         if value is not None:
             if isinstance(value, str):
                 value = value.strip()
             if value != "":
-                self.__headers.append((keyword, value))
+                self.response_headers.add(keyword, value)
 
-    def end_headers(self):
+    def end_headers(self, body: bytes = b''):
         """
-        Overridden method to write stored headers using super send_header method
-        before calling super end_headers method.
+        Overridden method to send the status line, the stored headers and the body
+        to the client with a single write.
+
+        Adds the Connection header if the connection is closed after this response
+        (or kept open for a HTTP/1.0 client asking for keep-alive).
+
+        Args:
+            body (bytes): the response body, written in the same buffer as the headers
+                if it is not larger than single_write_limit.
         """
-        if self.__headers is None:
-            self.__headers = []
-        for key, value in self.__headers:
-            super().send_header(key, value)
-        self.__headers = []
-        return super().end_headers()
+        if self.response_headers is None:
+            self.response_headers = HeaderMap()
+        connection = self.response_headers.get('Connection')
+        if connection is None:
+            if self.close_connection or self.requests_handled >= settings('keep alive max requests', 100):
+                connection = 'close'
+                self.response_headers.add('Connection', connection)
+            elif self.request_version == 'HTTP/1.0':
+                connection = 'keep-alive'
+                self.response_headers.add('Connection', connection)
+        if connection is not None:
+            if connection.lower() == 'close':
+                self.close_connection = True
+            elif connection.lower() == 'keep-alive':
+                self.close_connection = False
+        self.headers_sent = True
+        if self.request_version != 'HTTP/0.9':
+            status_line = b''.join(getattr(self, '_headers_buffer', ()))
+            self._headers_buffer = []
+            if len(body) <= self.single_write_limit:
+                body, head_body = b'', body
+            else:
+                head_body = b''
+            self.wfile.write(build_response(status_line, self.response_headers, head_body))
+        self.response_headers.clear()
+        if body:
+            self.wfile.write(body)
+        record_progress()
 
     def search_header(self, keyword, case_sensitive=True) -> Any:
         """
@@ -145,17 +254,13 @@ class SimpleServer(http.SimpleHTTPRequestHandler):  # eine Klasse 'Server' erste
          returns value of key if it is found,
          if key exists multiple times, returns first value else None
         """
-        if self.__headers is None:
-            self.__headers = []
+        if self.response_headers is None:
+            return None
         if not case_sensitive:
-            keyword = str(keyword).lower()
-        for key, value in self.__headers:
-            if case_sensitive:
-                if key == keyword:
-                    return value
-            else:
-                if str(key).lower() == keyword:
-                    return value
+            return self.response_headers.get(keyword)
+        for key, value in self.response_headers.get_all(keyword):
+            if key == keyword:
+                return value
         return None
 
     def get_path_segment_by_index(self, position: int) -> str:
@@ -164,13 +269,13 @@ class SimpleServer(http.SimpleHTTPRequestHandler):  # eine Klasse 'Server' erste
 
         The index must be a non-negative integer. If the index is out of bounds, an empty string is returned.
 
-        If the pathlist attribute is None or empty, it is initialized by calling the splitpath function with the current path.
+        If the pathlist attribute is None, it is initialized with the path segments of the request view.
 
         Raises:
             TypeError: If the position argument is not an integer.
         """
-        if self.pathlist is None or not self.pathlist:
-            self.pathlist = splitpath(self.path)
+        if self.pathlist is None:
+            self.pathlist = self.view.segments
         if not isinstance(position, int):
             raise TypeError('position MUST be of type int')
         try:
@@ -184,9 +289,11 @@ class SimpleServer(http.SimpleHTTPRequestHandler):  # eine Klasse 'Server' erste
         Return the server version, consisting of the string "Python-WebServer-Template" and the current git commit hash.
 
         If the commit hash is not available for any reason, return just the string "drive-desaster/Python-WebServer-Template".
+        The version is resolved on the first call, see resolve_version.
         """
-        if commit_hash is not None:
-            return f"Python-WebServer-Template-{commit_hash}"
+        version = resolve_version()
+        if version is not None:
+            return f"Python-WebServer-Template-{version}"
         else:
             return "drive-desaster/Python-WebServer-Template"
 
@@ -203,36 +310,367 @@ class SimpleServer(http.SimpleHTTPRequestHandler):  # eine Klasse 'Server' erste
         if self.search_header('Content-Type', case_sensitive=False) is None:
             self.send_header('Content-Type', content_type)
         if 'Accept-Encoding' in self.headers:
-            string, encoding = compress_data(string, parse_accept_encoding_header(self.headers['Accept-Encoding']))
-            self.send_header('Content-Encoding', encoding)
+            string, encoding = compress_data(
+                string,
+                self.view.accept_encodings,
+                cache=compressed_cache,
+                policy=compression_policy,
+                content_type=self.search_header('Content-Type', case_sensitive=False)
+                )
+            if encoding != 'identity':
+                self.send_header('Content-Encoding', encoding)
         self.send_header('Content-Length', len(string))
-        self.do_HEAD(status)
-        self.wfile.write(string)
+        self.do_HEAD(status, string)
+
+    def return_cached(self, key, render, content_type: str = 'text/html', status: int = 200):
+        """
+        Send a body that only depends on key and the settings from the render cache.
+
+        On a miss render() is called, it returns the body (str or bytes, None if it
+        already sent a response itself) and the status. The body is stored compressed
+        with the negotiated encoding together with the headers render set, so later
+        requests skip rendering and compressing, see general.cached_page.
+        """
+        encoding = self.view.encoding if compression_policy.compressible(content_type) else 'identity'
+        cache_key = (key, settings.version, encoding)
+        entry = render_cache.get(cache_key)
+        if entry is None:
+            body, status = render()
+            if body is None:
+                return
+            if not isinstance(body, bytes):
+                body = bytes(str(body), 'UTF-8')
+            if self.search_header('Content-Type', case_sensitive=False) is None:
+                self.send_header('Content-Type', content_type)
+            headers = list(self.response_headers)
+            self.response_headers.clear()
+            body, encoding = compress_data(
+                body,
+                [encoding],
+                policy=compression_policy,
+                content_type=content_type
+                )
+            entry = (body, encoding, status, headers)
+            render_cache.put(cache_key, entry, len(body))
+        body, encoding, status, headers = entry
+        for name, value in headers:
+            if self.search_header(name, case_sensitive=False) is None:
+                self.send_header(name, value)
+        if compression_policy.compressible(content_type):
+            self.send_header('Vary', 'Accept-Encoding')
+        if encoding != 'identity':
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', len(body))
+        self.do_HEAD(status, body)
+
+    def return_stream(self, chunks, content_type: str = 'text/plain', status: int = 200):
+        """
+        Send a response body that is produced piece by piece, e.g. by a generator.
+
+        Every chunk is compressed as it arrives and sent right away, so the client gets
+        the first bytes before the whole body exists. HTTP/1.1 clients get the body with
+        chunked transfer encoding, HTTP/1.0 clients get it delimited by closing the connection.
+
+        Args:
+            chunks: iterable of bytes or str (encoded as UTF-8).
+            content_type (str): the Content-Type, unless one was set with send_header before.
+            status (int): the status code.
+        """
+        if self.search_header('Content-Type', case_sensitive=False) is None:
+            self.send_header('Content-Type', content_type)
+        content_type = self.search_header('Content-Type', case_sensitive=False)
+        encoding = 'identity'
+        if 'Accept-Encoding' in self.headers and compression_policy.compressible(content_type):
+            encoding = self.view.encoding
+        compressor = StreamCompressor(encoding, compression_policy.level_for(content_type))
+        if encoding != 'identity':
+            self.send_header('Content-Encoding', encoding)
+        chunked = self.request_version == 'HTTP/1.1' and self.protocol_version == 'HTTP/1.1'
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.close_connection = True
+        # not do_HEAD, the body length is unknown
+        self.send_response(status)
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        for chunk in chunks:
+            if not isinstance(chunk, bytes):
+                chunk = bytes(str(chunk), 'UTF-8')
+            self._write_chunk(compressor.compress(chunk), chunked)
+        self._write_chunk(compressor.finish(), chunked)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, data: bytes, chunked: bool):
+        if not data:
+            return  # an empty chunk would end a chunked body
+        if chunked:
+            self.wfile.write(b'%X\r\n%b\r\n' % (len(data), data))
+        else:
+            self.wfile.write(data)
+        record_progress()
 
     def return_file(self, path: str, *, status: int = 200,  error_status: int = 404):
+        """
+        Send the file at path to the client.
+
+        A precompressed sidecar (foo.css.gz ...) is sent if the client accepts its encoding.
+        Small files are served from the static file cache. Files up to 'compress max size'
+        bytes are compressed in memory if the client accepts an encoding, everything else
+        is streamed from disk, so the memory used per download does not depend on the file size.
+        Successful responses carry ETag and Last-Modified, conditional requests for an
+        unchanged file are answered with 304 Not Modified and Range requests with 206 Partial Content.
+        """
         try:
-            byte_file = open(path, 'rb')
-            body = byte_file.read()
-            byte_file.close()
-            if self.search_header('Content-Type', case_sensitive=False) is None:
-                self.send_header('Content-Type', self.guess_type(path))
+            stat_result = os.stat(path)
+            if stat.S_ISDIR(stat_result.st_mode):
+                raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), path)
+            source, source_stat = path, stat_result
+            content_type = self.search_header('Content-Type', case_sensitive=False) or self.guess_type(path)
+            ranges = None
+            if status == 200 and settings('range requests', True):
+                self.send_header('Accept-Ranges', 'bytes')
+                if 'Range' in self.headers and self.command in ('GET', 'HEAD'):
+                    ranges = parse_range_header(self.headers['Range'], stat_result.st_size, settings('max ranges', 16))
+            encoding = 'identity'
+            encodings = None
+            precompressed = None
+            if 'Accept-Encoding' in self.headers and ranges is None:
+                # ranges always refer to the uncompressed file
+                encodings = self.view.accept_encodings
+                if settings('precompressed files', True):
+                    precompressed = find_precompressed(path, stat_result, encodings)
+                if precompressed is not None:
+                    source, encoding, source_stat = precompressed
+                elif (stat_result.st_size <= settings('compress max size', 2 ** 23)
+                        and compression_policy.should_compress(content_type, stat_result.st_size)):
+                    encoding = self.view.encoding
         except OSError as e:
-            status = error_status
-            body = bytes(str(e), 'UTF-8')
             self.send_header('Content-Type', 'text/plain')
-        if 'Accept-Encoding' in self.headers:
-            body, encoding = compress_data(body, parse_accept_encoding_header(self.headers['Accept-Encoding']))
+            return self.return_string(str(e), status=error_status)
+        if precompressed is not None or compression_policy.should_compress(content_type, stat_result.st_size):
+            self.send_header('Vary', 'Accept-Encoding')
+        if status == 200 and self.check_validators(path, stat_result, encoding):
+            return
+        if ranges is not None and 'If-Range' in self.headers:
+            if not if_range_matches(self.headers['If-Range'], *validator_index.get_validators(path, stat_result)):
+                ranges = None
+        try:
+            body = static_cache.read(source, source_stat)
+            byte_file = open(source, 'rb') if body is None else None
+        except OSError as e:
+            self.send_header('Content-Type', 'text/plain')
+            return self.return_string(str(e), status=error_status)
+        if ranges is not None:
+            if byte_file is None:
+                return self.send_ranges(body, ranges, stat_result.st_size, content_type)
+            with byte_file:
+                return self.send_ranges(byte_file, ranges, stat_result.st_size, content_type)
+        if self.search_header('Content-Type', case_sensitive=False) is None:
+            self.send_header('Content-Type', content_type)
+        if precompressed is not None:
             self.send_header('Content-Encoding', encoding)
+        elif encoding != 'identity':
+            if byte_file is not None:
+                with byte_file:
+                    body = byte_file.read()
+                byte_file = None
+            body, encoding = compress_data(
+                body,
+                encodings,
+                cache=compressed_cache,
+                key=os.path.abspath(path),
+                version=(stat_result.st_mtime_ns, stat_result.st_size),
+                policy=compression_policy,
+                content_type=content_type
+                )
+            if encoding != 'identity':
+                self.send_header('Content-Encoding', encoding)
+        if byte_file is not None:
+            with byte_file:
+                size = os.fstat(byte_file.fileno()).st_size
+                self.send_header('Content-Length', size)
+                self.do_HEAD(status)
+                return self.send_file_body(byte_file, 0, size)
         self.send_header('Content-Length', len(body))
-        self.do_HEAD(status)
-        self.wfile.write(body)
+        self.do_HEAD(status, body)
+
+    def send_ranges(self, source, ranges: list, size: int, content_type: str):
+        """
+        Send 206 Partial Content with byte ranges of a file, or 416 if no range is satisfiable.
 
-    def do_HEAD(self, status: int = 501):
-        """send header infomation back too client"""
+        A single range is sent as it is, several ranges as multipart/byteranges.
+
+        Args:
+            source: the content as bytes or the open binary file.
+            ranges (list): (start, end) tuples as returned by parse_range_header.
+            size (int): the size of the whole file.
+            content_type (str): the Content-Type of the file.
+        """
+        if not ranges:
+            self.send_header('Content-Range', f"bytes */{size}")
+            return self.do_HEAD(416)
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            if self.search_header('Content-Type', case_sensitive=False) is None:
+                self.send_header('Content-Type', content_type)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+            self.send_header('Content-Length', end - start + 1)
+            self.do_HEAD(206)
+            return self._send_slice(source, start, end - start + 1)
+        boundary = uuid.uuid4().hex
+        parts = []
+        for start, end in ranges:
+            head = (
+                f"\r\n--{boundary}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                ).encode('latin-1')
+            parts.append((head, start, end))
+        closing = f"\r\n--{boundary}--\r\n".encode('latin-1')
+        self.send_header('Content-Type', f"multipart/byteranges; boundary={boundary}")
+        self.send_header('Content-Length', sum(len(head) + end - start + 1 for head, start, end in parts) + len(closing))
+        self.do_HEAD(206)
+        if self.command == 'HEAD':
+            return
+        for head, start, end in parts:
+            self.wfile.write(head)
+            record_progress()
+            self._send_slice(source, start, end - start + 1)
+        self.wfile.write(closing)
+
+    def _send_slice(self, source, offset: int, count: int):
+        if isinstance(source, bytes):
+            self.write_body(memoryview(source)[offset:offset + count])
+        else:
+            self.send_file_body(source, offset, count)
+
+    def check_validators(self, path: str, stat_result: os.stat_result, encoding: str = 'identity') -> bool:
+        """
+        Send ETag and Last-Modified of the file and answer conditional requests.
+
+        The validators come from the validator index. Compressed variants get their own ETag.
+        If-None-Match takes precedence over If-Modified-Since.
+
+        Returns:
+            True if 304 Not Modified was sent and the response is complete.
+        """
+        etag, last_modified = validator_index.get_validators(path, stat_result)
+        if encoding != 'identity':
+            etag = etag[:-1] + '-' + encoding + '"'
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        if self.command not in ('GET', 'HEAD'):
+            return False
+        if 'If-None-Match' in self.headers:
+            not_modified = etag_matches(self.headers['If-None-Match'], etag)
+        elif 'If-Modified-Since' in self.headers:
+            not_modified = not_modified_since(self.headers['If-Modified-Since'], stat_result.st_mtime)
+        else:
+            return False
+        if not_modified:
+            self.do_HEAD(304)
+        return not_modified
+
+    def send_file_body(self, byte_file, offset: int, count: int):
+        """
+        Write count bytes of the open binary file, starting at offset, to the client.
+
+        Plain sockets use os.sendfile, so the data is copied by the kernel. TLS sockets and the
+        asyncio engine get a loop of positional reads (os.pread) of chunk_size bytes. If the
+        file shrank in the meantime the connection is closed, as the announced Content-Length
+        can not be met anymore. Every write counts as progress of the request, see longest_stall.
+        """
+        if self.command == 'HEAD' or count <= 0:
+            return
+        connection = getattr(self, 'connection', None)
+        sent = 0
+        if hasattr(os, 'sendfile') and type(connection) is socket.socket:  # not for ssl.SSLSocket
+            self.wfile.flush()
+            sent = self._sendfile(connection, byte_file, offset, count)
+        if sent == 0:
+            while sent < count:
+                chunk = os.pread(byte_file.fileno(), min(self.chunk_size, count - sent), offset + sent)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                record_progress()
+        if sent < count:
+            self.close_connection = True
+
+    def _sendfile(self, connection: socket.socket, byte_file, offset: int, count: int) -> int:
+        """
+        os.sendfile loop honouring the socket timeout, like socket.sendfile, but recording progress
+        after every call. Returns 0 if sendfile can not be used for the file, before anything was sent.
+        """
+        timeout = connection.gettimeout()
+        sent = 0
+        while sent < count:
+            try:
+                piece = os.sendfile(connection.fileno(), byte_file.fileno(), offset + sent, count - sent)
+            except BlockingIOError:
+                if not select.select([], [connection], [], timeout)[1]:
+                    raise TimeoutError("timed out")
+                continue
+            except OSError as e:
+                if sent == 0 and e.errno in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                    return 0
+                raise
+            if piece == 0:
+                break
+            sent += piece
+            record_progress()
+        return sent
+
+    def write_body(self, body: bytes):
+        """write the response body, unless the client only asked for the headers"""
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+            record_progress()
+
+    def do_HEAD(self, status: int = 501, body: bytes = b''):
+        """
+        send header infomation back too client, followed by body unless the client only asked for the headers
+
+        The first call of a HEAD request comes from http.server, the request is then routed like
+        a GET request and answered without body, see write_body.
+        """
+        if self.command == 'HEAD' and not self._head_routed:
+            self._head_routed = True
+            return self.do_GET()
+        if (status >= 200 and status not in (204, 304)
+                and self.search_header('Content-Length', case_sensitive=False) is None
+                and self.search_header('Transfer-Encoding', case_sensitive=False) is None):
+            # without a body length the client of a persistent connection would wait for more
+            self.send_header('Content-Length', 0)
         self.send_response(status)
-        self.end_headers()
+        self.end_headers(body if self.command != 'HEAD' else b'')
+
+    def send_exception(self, message: str):
+        """
+        Report an error to the client with status 500 and close the connection.
+
+        If the response headers were already sent, the connection is only closed,
+        since the client could not tell a second response apart from the first body.
+        """
+        self.close_connection = True
+        if not self.headers_sent:
+            self.response_headers.clear()
+            self._headers_buffer = []
+            self.return_string(message, status=500)
+
+    def log_request(self, code='-', size='-'):
+        """Log an accepted request, with its status as a field of structured logs."""
+        if is_probe(self):
+            return
+        if isinstance(code, http.HTTPStatus):
+            code = code.value
+        self.log_message('"%s" %s %s', self.requestline, str(code), str(size), status=code)
 
-    def log_message(self, format_str, *args, logfile: str = None):
+    def log_message(self, format_str, *args, logfile: str = None, **fields):
         """Log an arbitrary message.
 
         This is used by all other logging functions.  Override
@@ -244,39 +682,41 @@ class SimpleServer(http.SimpleHTTPRequestHandler):  # eine Klasse 'Server' erste
         specified as subsequent arguments (it's just like
         printf!).
 
-        The client ip and current date/time are prefixed to
-        every message.
+        The message is only queued, a LogWriter thread prefixes the client ip
+        and date/time and writes it to the log file, see log_writer.
+        Keyword arguments are added to structured (JSON) records.
 
         """
         if logfile is None:
-            logfile = settings('logfile', 'log.log')
-        logstring = (
-            f"{self.address_string()} - - "
-            f"[{self.log_date_time_string()}] "
-            f"{format_str % args}\n"
-        )
-        with open(logfile, 'a') as log:
-            log.write(logstring)
-        print(logstring, end='')
+            writer = log_writer('logfile', 'log.log', echo=settings('log console', True))
+        else:
+            writer = get_log_writer(logfile)
+        writer.log(self.address_string(), format_str % args, request=getattr(self, 'requestline', ''), **fields)
 
     def preprocess(self):
-        self.pathlist = splitpath(self.path)
         self.rawpath = self.path
+        self.pathlist = self.view.segments
         self.path = parse.unquote(self.path)
 
+    def dispatch(self):
+        """
+        Call the handler routed for the method and path of the request, see routing.Router.
+        Answers 404, or 405 with an Allow header, if there is none.
+        """
+        match = router.match(self.command, self.pathlist)
+        if match.handler is None:
+            if match.allowed:
+                self.send_header('Allow', ', '.join(sorted(match.allowed)))
+                return self.do_HEAD(405)
+            return self.do_HEAD(404)
+        return match.handler(self, **match.params)
+
     def do_GET(self):
         """Handle GET requests coming to the server.
 
         - Checks the client version.
         - Preprocesses the request.
-        - Handles specific paths:
-            - robots.txt: Sends the file.
-            - file/files: Sends the requested file.
-            - favicon.ico/png/svg: Sends the favicon file.
-            - .well-known: Sends the requested file from the server's well-known directory.
-            - reload: Reloads the addons module.
-            - css: Sends the requested CSS file. If the path is not specified, sends the default CSS file.
-            - addons: Delegates to the addons module.
+        - Calls the routed handler, see the core routes below and the router of the addons module.
         - Raises an exception if an error occurs after returning the errormessage to the client.
 
         """
@@ -284,77 +724,264 @@ class SimpleServer(http.SimpleHTTPRequestHandler):  # eine Klasse 'Server' erste
             if not self.checkVersion():
                 return
             self.preprocess()
-            path0 = self.get_path_segment_by_index(0).lower()
-            if path0 == 'robots.txt':
-                self.send_header('Cache-Controll', 'max-age=86400, public')
-                self.return_file('robots.txt')
-            elif path0 in ('file', 'files'):
-                self.return_file(settings.get_path('fileroot', *self.pathlist[1:]))
-            elif os.path.splitext(path0)[0] == 'favicon' or path0 in ('favicon', 'favicon.ico', 'favicon.png', 'favicon.svg'):
-                self.send_header('Cache-Controll', 'max-age=86400, public')
-                self.return_file(settings('favicon', 'favicon.ico'))
-            elif path0 == '.well-known':
-                self.return_file(settings.get_path('well-known', *self.pathlist[1:]))
-            elif path0 == 'reload':
-                importlib.reload(addons)
-                self.return_string('sucess')
-            elif path0 == 'css':
-                if len(self.pathlist) == 1:
-                    self.return_file(settings.get_path('css dir',  'default.css'))
-                else:
-                    self.return_file(settings.get_path('css dir', *self.pathlist[1:]))
-            else:
-                if 'addons' in globals() and hasattr(addons, 'get'):
-                    addons.get(self)
-                else:
-                    self.do_HEAD(status=501)
+            self.dispatch()
         except Exception as e:
-            self.return_string('ERROR: ' + str(e), status=500)
+            self.send_exception('ERROR: ' + str(e))
             raise e
 
-    def do_POST(self):
-        """Handle POST requests coming to the server.
+    def body_limit(self) -> int:
+        """
+        The maximum accepted body size for the Content-Type of the request:
+        'max body size <type>' (e.g. 'max body size application/json'), else 'upload max size'
+        for multipart/form-data, 'max put size' (default 'upload max size') for PUT, which
+        streams its body, and 'max body size' for all other types.
+        """
+        content_type = self.headers.get_content_type()
+        if content_type == 'multipart/form-data':
+            default = settings('upload max size', 2 ** 30)
+        elif self.command == 'PUT':
+            default = settings('max put size', settings('upload max size', 2 ** 30))
+        else:
+            default = settings('max body size', 2 ** 20)
+        return settings(f'max body size {content_type}', default)
 
-        - Checks the clinet version.
-        - Preprocesses the request.
-        - Extracts the request parameters from the request.
-        - Delegates to the addons module to process the request.
-        - Raises an exception if an error occurs after returning the errormessage to the client.
+    def reject_body(self) -> bool:
+        """
+        Answer 413 and close the connection if the announced body is larger than body_limit,
+        so it is refused before it is read.
+        """
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = 0
+        if length <= self.body_limit():
+            return False
+        self.close_connection = True
+        self.return_string('request body too large', status=413)
+        return True
+
+    def handle_expect_100(self):
+        """
+        Refuse oversized bodies before the client sends them, otherwise send 100 Continue.
+
+        The interim response bypasses end_headers, so the final response (including
+        errors while reading the body) is still sent afterwards.
+        """
+        if self.reject_body():
+            return False
+        self.send_response_only(100)
+        self.wfile.write(b''.join(self._headers_buffer) + b'\r\n')
+        self._headers_buffer = []
+        return True
 
+    def open_body(self) -> RequestParameters.BodyReader:
+        """
+        Return a reader for the request body, delimited by Content-Length or chunked
+        transfer encoding and limited to body_limit bytes.
+
+        Raises:
+            RequestParameters.MalformedBody: if the framing headers are invalid.
         """
+        transfer_encoding = self.headers.get('Transfer-Encoding')
+        if transfer_encoding is not None:
+            if transfer_encoding.strip().lower() != 'chunked':
+                raise RequestParameters.MalformedBody("unsupported transfer encoding " + transfer_encoding)
+            if 'Content-Length' in self.headers:
+                # conflicting framing, do not trust the rest of the connection
+                self.close_connection = True
+            return RequestParameters.BodyReader(
+                self.rfile, chunked=True, limit=self.body_limit(), on_data=record_progress)
         try:
-            if not self.checkVersion():
-                return
-            self.preprocess()
-            if 'addons' in globals() and hasattr(addons, 'post'):
-                self.postdata = RequestParameters.process_request(
-                    self.headers['Content-Type'],
-                    self.rfile,
-                    int(self.headers['Content-Length'])
-                    )
-                return addons.post(self)
-            else:
-                return self.do_HEAD(status=501)
-        except Exception as e:
-            self.return_string(str(e), status=500)
-            raise e
-    
-    def do_PUT(self):
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            raise RequestParameters.MalformedBody("invalid Content-Length")
+        return RequestParameters.BodyReader(self.rfile, length, limit=self.body_limit(), on_data=record_progress)
+
+    @property
+    def postdata(self):
+        """
+        The parsed request body, read on first access: FormData for forms and uploads,
+        the decoded document for JSON. Uploaded files are spooled to fileroot/userfiles.
         """
-        handle PUT requests by calling the addons.put function
+        if self._postdata is None:
+            spool_dir = settings.get_path('fileroot', 'userfiles')
+            os.makedirs(spool_dir, exist_ok=True)
+            self._postdata = RequestParameters.process_request(
+                self.headers['Content-Type'],
+                self.body,
+                -1 if self.body.length is None else self.body.length,
+                spool_dir=spool_dir,
+                memory_limit=settings('upload memory limit', 2 ** 20),
+                max_parts=settings('upload max parts', 128)
+                )
+        return self._postdata
+
+    def handle_body_request(self):
+        """
+        Dispatch a request with a body.
+
+        The routed handler reads the body as it arrives, either from body (a
+        RequestParameters.BodyReader) or parsed through postdata. Whatever it leaves
+        unread is skipped before the next request on the connection.
+        Oversized bodies are answered with 413, malformed ones with 400 and
+        bodies postdata can not parse with 415.
         """
         try:
             if not self.checkVersion():
                 return
             self.preprocess()
-            if 'addons' in globals() and hasattr(addons, 'put'):
-                return addons.put(self)
-            else:
-                return self.do_HEAD(status=501)
+            if self.reject_body():
+                return
+            self.body = self.open_body()
+            try:
+                result = self.dispatch()
+            finally:
+                if isinstance(self._postdata, RequestParameters.FormData):
+                    self._postdata.cleanup()
+            # the next request on this connection starts after the body
+            if not self.body.discard():
+                self.close_connection = True
+            return result
+        except RequestParameters.BodyTooLarge as e:
+            self.send_client_error(413, str(e))
+        except RequestParameters.UnsupportedMediaType as e:
+            self.send_client_error(415, str(e), discard=True)
+        except RequestParameters.MalformedBody as e:
+            self.send_client_error(400, str(e))
         except Exception as e:
-            self.return_string(str(e), status=500)
+            self.send_exception(str(e))
             raise e
 
+    def send_client_error(self, status: int, message: str, discard: bool = False):
+        """
+        Answer a malformed or refused request.
+
+        The connection is closed, unless discard is set and the rest of the body can be skipped.
+        """
+        if not (discard and self.body is not None and self.body.discard()):
+            self.close_connection = True
+        if not self.headers_sent:
+            self.response_headers.clear()
+            self.return_string(message, status=status)
+
+    def do_POST(self):
+        """Handle POST requests coming to the server.
+
+        - Checks the clinet version.
+        - Preprocesses the request.
+        - Refuses bodies larger than the configured limit with 413.
+        - Calls the routed handler, which reads the body through postdata or body.
+        - Raises an exception if an error occurs after returning the errormessage to the client.
+
+        """
+        return self.handle_body_request()
+
+    def do_PUT(self):
+        """
+        handle PUT requests by calling the routed handler, which streams the
+        body from body, e.g. with body.iter_chunks()
+        """
+        return self.handle_body_request()
+
+
+core_router = Router()
+
+
+@core_router.get('/robots.txt')
+def robots_txt(server: SimpleServer):
+    server.send_header('Cache-Controll', 'max-age=86400, public')
+    server.return_file('robots.txt')
+
+
+@core_router.get('/file/<path:path>', '/files/<path:path>')
+def files(server: SimpleServer, path: list[str]):
+    # hidden entries are not public, e.g. the object store (.objects) and upload spool files (.upload-*.tmp)
+    if any(segment.startswith('.') for segment in path):
+        return server.do_HEAD(404)
+    server.return_file(settings.get_path('fileroot', *path))
+
+
+@core_router.get(*(f'/favicon{extension}' for extension in ('', '.ico', '.png', '.svg', '.gif', '.jpg', '.jpeg', '.webp')))
+def favicon(server: SimpleServer):
+    server.send_header('Cache-Controll', 'max-age=86400, public')
+    server.return_file(settings('favicon', 'favicon.ico'))
+
+
+@core_router.get('/.well-known/<path:path>')
+def well_known(server: SimpleServer, path: list[str]):
+    server.return_file(settings.get_path('well-known', *path))
+
+
+def is_admin(server: SimpleServer) -> bool:
+    """
+    True if the request carries the header 'Authorization: Bearer <admin token>'.
+    Admin routes are disabled while no 'admin token' is configured.
+    """
+    token = str(settings('admin token', ''))
+    scheme, _, given = server.headers.get('Authorization', '').partition(' ')
+    return bool(token) and scheme.lower() == 'bearer' and hmac.compare_digest(given.strip().encode(), token.encode())
+
+
+@core_router.route('/reload', methods=('GET', 'POST'))
+def reload_addons(server: SimpleServer):
+    """
+    Ask the supervisor for a graceful reload of all workers, see Supervisor.reload.
+
+    Requires the admin token, see is_admin.
+    """
+    if not is_admin(server):
+        server.return_string('forbidden', status=403)
+    elif request_reload():
+        server.return_string('reload scheduled', status=202)
+    else:
+        server.return_string('not running under a supervisor', status=503)
+
+
+@core_router.get('/stats')
+def worker_stats(server: SimpleServer):
+    """the counters of the worker answering the request as JSON, requires the admin token"""
+    if not is_admin(server):
+        server.return_string('forbidden', status=403)
+        return
+    stats = {
+        'pid': os.getpid(),
+        'static cache': static_cache.stats(),
+        'compressed cache': compressed_cache.stats(),
+        'render cache': render_cache.stats(),
+    }
+    if hasattr(server.server, 'stats'):
+        stats['server'] = server.server.stats()
+    if tls is not None:
+        stats['tls'] = tls.stats()
+    server.send_header('Cache-Control', 'no-store')
+    server.return_string(json.dumps(stats), 'application/json')
+
+
+@core_router.get('/css/<path:path>')
+def css(server: SimpleServer, path: list[str]):
+    server.return_file(settings.get_path('css dir', *(path or ['default.css'])))
+
+
+def build_router() -> Router:
+    """
+    Combine the core routes with the routes of the addons module.
+
+    Addons register their handlers on addons.router. Older addons modules only
+    providing get/post/put functions receive every request no route matched.
+    """
+    combined = Router()
+    combined.include(core_router)
+    if 'addons' in globals():
+        if isinstance(getattr(addons, 'router', None), Router):
+            combined.include(addons.router)
+        else:
+            for method in ('get', 'post', 'put'):
+                if hasattr(addons, method):
+                    combined.route('/<path:path>', methods=(method.upper(),))(
+                        lambda server, path, function=getattr(addons, method): function(server)
+                        )
+    return combined
+
 
 class ForwardServer(http.SimpleHTTPRequestHandler):
     """
@@ -406,79 +1033,337 @@ class ForwardServer(http.SimpleHTTPRequestHandler):
             self.close_connection = True
             return
 
-    def log_message(self, format, *args):
-        logfile = settings('forwardlogfile', 'forwardlog.log')
-        with open(logfile, 'a') as log:
-            log.write(
-                f"{self.address_string()} - - "
-                f"[{self.log_date_time_string()}] "
-                f"{format_str % args}\n"
+    def log_request(self, code='-', size='-'):
+        if not is_probe(self):
+            super().log_request(code, size)
+
+    def log_message(self, format_str, *args):
+        log_writer('forwardlogfile', 'forwardlog.log').log(
+            self.address_string(), format_str % args, request=getattr(self, 'requestline', '')
             )
 
 
-def run_server(server, use_ssl: bool, port: int, host: str) -> None:
-    # Create an HTTPServer bound to the specified host and port.
-    httpd = http.HTTPServer((host, port), server)
+def is_probe(handler: http.BaseHTTPRequestHandler) -> bool:
+    """True for the liveness probes of the supervisor, which are kept out of the access logs"""
+    headers = getattr(handler, 'headers', None)
+    return (
+        handler.command == 'HEAD'
+        and headers is not None
+        and headers.get('User-Agent') == PROBE_AGENT
+        and handler.client_address[0] in ('127.0.0.1', '::1')
+        )
+
 
-    # If the ssl argument is True, create an SSL/TLS context and wrap the server's
-    # socket in the context to make it an HTTPS server. Otherwise, leave it as an HTTP server.
+def record_progress():
+    """note that the request of the current thread read or wrote data, see longest_stall"""
+    ident = threading.get_ident()
+    if ident in active_requests:
+        active_requests[ident] = monotonic()
 
-    if use_ssl:
-        context = ssl.SSLContext(protocol=ssl.PROTOCOL_TLS_SERVER)
-        context.load_cert_chain(settings['ssl key chain'], keyfile=settings['ssl key'])
-        httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
 
-    # Start the HTTPServer and run it indefinitely.
-    httpd.serve_forever()
+def longest_stall() -> float:
+    """seconds since the I/O of the least recently progressing active request of this process, 0 if none is active"""
+    progress = min(active_requests.values(), default=None)
+    return 0.0 if progress is None else monotonic() - progress
 
 
-def check_website(url: str, timeout: int, status: int):
+def last_progress() -> float:
+    """monotonic time of the latest I/O of the active requests of this process, now if none is active"""
+    return max(active_requests.values(), default=None) or monotonic()
+
+
+def refresh_settings() -> bool:
+    """
+    Apply changes of settings.txt (and its included files) without restarting the worker.
+
+    The files are checked at most every 'settings check interval' seconds. Objects
+    derived from the settings at startup are rebuilt after a reload, cached pages are
+    keyed by the settings version and expire on their own.
+
+    Returns:
+        True if the settings were reloaded.
+    """
+    if not settings.reload_if_due(settings('settings check interval', 2.0)):
+        return False
+    apply_settings()
+    return True
+
+
+def apply_settings():
+    """rebuild the objects derived from the settings"""
+    global compression_policy
+    compression_policy = CompressionPolicy.from_settings(settings)
+    if 'html dir' in settings and os.path.isdir(settings['html dir']):
+        load_templates(settings['html dir'])
+
+
+def reload_application():
+    """
+    Reload settings and addons in the supervisor before it forks a new worker generation.
+
+    Raises:
+        Exception: anything raised while importing the addons, the reload is cancelled then.
+    """
+    global router
+    settings.reload(force=True)
+    apply_settings()
+    if tls is not None:
+        server_tls()
+    if 'addons' in globals():
+        importlib.reload(addons)
+    router = build_router()
+
+
+def log_writer(key: str, default: str, echo: bool = False) -> LogWriter:
     """
-    Check if a website responds with the given status code. Return True if it does, False otherwise.
+    Return the LogWriter for the log file configured under key.
+
+    'log format = json' writes JSON lines instead of the access log format, files are
+    rotated after 'log max size' bytes keeping 'log backups' old files. At most
+    'log queue size' records wait for the writer, more are dropped and counted.
+
+    Args:
+        key (str): the settings key of the file name.
+        default (str): the file name if key is not set.
+        echo (bool): also print the records.
+    """
+    return get_log_writer(
+        settings(key, default),
+        structured=str(settings('log format', 'text')).lower() == 'json',
+        echo=echo,
+        max_queue=settings('log queue size', 10000),
+        flush_interval=settings('log flush interval', 1.0),
+        max_bytes=settings('log max size', 2 ** 24),
+        backups=settings('log backups', 5)
+        )
+
+
+def create_server(server, port: int, host: str, *, sock: socket.socket = None, reuse_port: bool = False) -> http.HTTPServer:
+    """
+    Create the HTTPServer for the concurrency mode chosen in the settings.
+
+    'concurrency = single' handles one connection at a time,
+    'concurrency = threadpool' serves connections from a bounded pool of
+    'worker threads' threads with up to 'accept queue' connections waiting,
+    'concurrency = asyncio' keeps all connections in one event loop and handles
+    requests in an executor of 'worker threads' threads.
 
     Args:
-        url: The URL to check.
-        timeout: The maximum number of seconds to wait for a response.
-        status: The HTTP status code to expect.
+        server: the request handler class (SimpleServer or ForwardServer).
+        port (int): the port to bind to.
+        host (str): the host to bind to.
+        sock (socket.socket): an already listening socket to serve instead of binding a new one,
+            used by pre-forked workers sharing one socket.
+        reuse_port (bool): bind with SO_REUSEPORT so several processes can listen on the same port.
 
     Returns:
-        True if the website responds with the given status code, False otherwise.
+        The bound and listening server instance.
     """
+    mode = str(settings('concurrency', 'single')).strip().lower()
+    if mode in ('threadpool', 'thread pool', 'threads'):
+        httpd = ThreadPoolHTTPServer(
+            (host, port),
+            server,
+            False,
+            workers=settings('worker threads', 16),
+            queue_size=settings('accept queue', 64)
+            )
+    elif mode == 'asyncio':
+        # asyncio is only imported by the workers that use it
+        from aioserver import AsyncHTTPServer
+        httpd = AsyncHTTPServer(
+            (host, port),
+            server,
+            False,
+            workers=settings('worker threads', 16),
+            idle_timeout=settings('keep alive timeout', 15)
+            )
+    elif mode == 'single':
+        httpd = http.HTTPServer((host, port), server, False)
+        # one idle keep-alive connection would block every other client
+        httpd.persistent_connections = False
+    else:
+        raise ValueError("unknown concurrency mode: " + mode)
+
     try:
-        response = requests.get(url, timeout=timeout, allow_redirects=False)
-        if response.status_code == status:
-            # Website exists and is responding
-            return True
+        if sock is not None:
+            httpd.socket.close()
+            httpd.socket = sock
+            httpd.server_address = sock.getsockname()
+            httpd.server_name = socket.getfqdn(httpd.server_address[0])
+            httpd.server_port = httpd.server_address[1]
         else:
-            print("response: ", response.status_code)
-            return False
-    except (requests.exceptions.RequestException):
-        # Website does not exist or is not responding
-        print("no response")
-        return False
+            httpd.allow_reuse_port = reuse_port
+            httpd.server_bind()
+            httpd.server_activate()
+    except BaseException:
+        httpd.server_close()
+        raise
+    return httpd
 
 
-def run_and_monitore_website(server, use_ssl: bool, port: int, check_target: str, expected_returncode: int, host: str):
-    server_process = multiprocessing.Process(target=run_server, args=(server, use_ssl, port, host))
-    server_process.start()
-    sleep(5)
-    while True:
-        if not check_website(check_target, 1, expected_returncode):
-            server_process.terminate()
-            sleep(0.25)
-            server_process = multiprocessing.Process(target=run_server, args=(server, use_ssl, port, host))
-            sleep(0.25)
-            server_process.start()
-        sleep(1*60*60)
+def server_tls():
+    """
+    Return the ServerTLS configured in the settings, created on first use.
 
+    Call it in the supervisor before the workers start, so they share its session cache
+    and ticket keys. It is only created again when the TLS settings changed, changed
+    certificate files are picked up by the ServerTLS itself.
+    """
+    global tls, tls_options
+    from tls import ServerTLS
+    options = dict(
+        certfile=settings['ssl key chain'],
+        keyfile=settings('ssl key', None) or None,
+        ciphers=settings('ssl ciphers', None) or None,
+        ecdh_curve=settings('ssl ecdh curve', None) or None,
+        session_tickets=settings('ssl session tickets', 2),
+        handshake_timeout=settings('ssl handshake timeout', 10),
+        reload_interval=settings('ssl reload interval', 5),
+        )
+    if tls is None or options != tls_options:
+        tls = ServerTLS(**options)
+        tls_options = options
+    return tls
+
+
+def run_server(server, use_ssl: bool, port: int, host: str, *, sock: socket.socket = None, reuse_port: bool = False) -> None:
+    # Create an HTTPServer bound to the specified host and port,
+    # or serving the socket handed over by the supervisor.
+    httpd = create_server(server, port, host, sock=sock, reuse_port=reuse_port)
+
+    # If the ssl argument is True, every accepted connection does a TLS handshake
+    # before its requests are read. Otherwise, leave it as an HTTP server.
+    if use_ssl:
+        server_tls_setup = server_tls()
+        if hasattr(httpd, 'ssl_context'):
+            # the event loop does the TLS handshakes itself
+            httpd.ssl_context = server_tls_setup.context
+            httpd.ssl_handshake_timeout = server_tls_setup.handshake_timeout
+            httpd.on_handshake = server_tls_setup.count
+        else:
+            server_tls_setup.install(httpd)
+
+    # report to the supervisor that this worker is alive as long as no request went without I/O
+    # for 'request timeout' seconds, from a thread of its own because the serving loop blocks
+    # while all handlers are busy. A write may wait for the client up to the socket timeout
+    # ('keep alive timeout') without any I/O, so the request timeout is kept above it.
+    def healthy():
+        return longest_stall() < max(settings('request timeout', 60), settings('keep alive timeout', 15) + 5)
+    start_heartbeat(healthy, progress=last_progress)
+
+    def drain():
+        # called from a signal handler of the main thread, which is blocked in serve_forever
+        httpd.persistent_connections = False
+        threading.Thread(target=httpd.shutdown, name="drain", daemon=True).start()
+    on_drain(drain)
+
+    # Start the HTTPServer and run it until the process is told to stop or drain.
+    try:
+        httpd.serve_forever()
+    finally:
+        if isinstance(httpd, ThreadPoolHTTPServer):
+            httpd.server_close(settings('drain timeout', 30))
+        else:
+            httpd.server_close()
+        close_log_writers()
+
+
+def create_supervisor() -> Supervisor:
+    """
+    Create the Supervisor for run_server with the liveness checks configured in the settings.
+
+    Workers are replaced after 'heartbeat timeout' seconds without a heartbeat, i.e. when a
+    request went without I/O for 'request timeout' seconds or the process froze. A heartbeat
+    timeout below 'keep alive timeout' is raised above it, 0 disables the check.
+    Listeners are probed every 'probe interval' seconds and restarted after 'probe failures'
+    probes in a row found them down, or busy while no worker made progress. Workers
+    crashing early are restarted after 'restart backoff' seconds, doubled for every further
+    early crash up to 'max restart backoff'.
+    """
+    heartbeat_timeout = settings('heartbeat timeout', 30)
+    if heartbeat_timeout:
+        heartbeat_timeout = max(heartbeat_timeout, settings('keep alive timeout', 15) + 5)
+    return Supervisor(
+        run_server,
+        poll_interval=settings('supervisor poll interval', 0.25),
+        heartbeat_timeout=heartbeat_timeout,
+        probe_interval=settings('probe interval', 1.0),
+        probe_timeout=settings('probe timeout', 1.0),
+        probe_failures=settings('probe failures', 3),
+        restart_backoff=settings('restart backoff', 0.5),
+        max_backoff=settings('max restart backoff', 30),
+        drain_timeout=settings('drain timeout', 30),
+        on_reload=reload_application
+        )
+
+
+def run_and_monitore_website(server, use_ssl: bool, port: int, host: str, workers: int = 1, probe: bool = True):
+    """
+    Run the server in supervised worker processes and restart them whenever
+    they stop sending heartbeats or, if probe is set, stop answering on port.
+    """
+    # resolve the version once instead of in every worker
+    resolve_version()
+    supervisor = create_supervisor()
+    supervisor.add_listener(
+        server, use_ssl, port, host,
+        workers=workers,
+        reuse_port=settings('reuse port', False),
+        probe=probe,
+        backlog=settings('accept queue', 64)
+        )
+    supervisor.run()
+
+
+@functools.cache
+def resolve_version() -> str:
+    """
+    Return the version shown in the Server header, resolved once per process.
+
+    It is taken from the environment variable VERSION_ENV, else from the file VERSION
+    next to this module (written at build or deploy time), else from the current git
+    commit. The result is stored in VERSION_ENV, so processes started later, e.g. the
+    workers, do not run git again. Nothing is resolved at import, run_and_monitore_website
+    resolves it before the workers are started.
 
+    Returns:
+        The version, or None if none of the sources is available.
+    """
+    version = os.environ.get(VERSION_ENV, '').strip()
+    if not version:
+        try:
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'VERSION'), 'r') as file:
+                version = file.read().strip()
+        except OSError:
+            pass
+    if not version:
+        import subprocess
+        try:
+            version = subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL
+            ).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    os.environ[VERSION_ENV] = version
+    return version
+
+
+VERSION_ENV = 'WEBSERVER_VERSION'
 settings = Settings('settings.txt')
-try:
-    commit_hash = subprocess.check_output(
-        ['git', 'rev-parse', '--short', 'HEAD']
-    ).decode().strip()
-except subprocess.CalledProcessError:
-    commit_hash = None
+static_cache = StaticFileCache(settings('static cache size', 2 ** 23), settings('static cache max file', 2 ** 18))
+compressed_cache = ByteLRUCache(settings('compressed cache size', 2 ** 24))
+compression_policy = CompressionPolicy.from_settings(settings)
+validator_index = ValidatorIndex(settings('validator index size', 4096))
+render_cache = ByteLRUCache(settings('render cache size', 2 ** 22))
+tls = None
+tls_options = None
+active_requests = {}  # thread ident -> monotonic time of the latest I/O of the request it handles
+if 'html dir' in settings and os.path.isdir(settings['html dir']):
+    load_templates(settings['html dir'])
+router = build_router()
 if __name__ == '__main__':
     # If this code is executed directly (and not imported as a module),
     # check if the ssl key in the settings dictionary is set to True,
@@ -486,15 +1371,32 @@ if __name__ == '__main__':
     if not os.path.isdir(settings['fileroot']):
         os.mkdir(settings['fileroot'])
 
+    host = settings('host', '127.0.0.1')
+    # resolve the version once instead of in every worker
+    resolve_version()
+    supervisor = create_supervisor()
     if settings('ssl', False):
-        server_process = multiprocessing.Process(target=run_server, args=(SimpleServer, True, settings('ssl port', 443)))
-        forward_process = multiprocessing.Process(target=run_server, args=(ForwardServer, False, settings('port', 80)))
-        server_process.start()
-        forward_process.start()
-        # Monitor the HTTPS server to make sure it's always running.
-        watchdog1 = multiprocessing.Process(target=run_and_monitore_website, args=(SimpleServer, True, settings('ssl port', 443), F"https://{settings('host', '127.0.0.1')}:{settings('ssl port', 443)}", 200, settings('host', '127.0.0.1')))
-        watchdog1.start()
-        watchdog2 = multiprocessing.Process(target=run_and_monitore_website, args=(ForwardServer, False, settings('port', 80), F"http://{settings('host', '127.0.0.1')}:{settings('port', 80)}", 308, settings('host', '127.0.0.1')))
-        watchdog2.start()
+        # created before the workers are forked, so they share the TLS session ticket keys
+        server_tls()
+        # the HTTPS server gets one worker per CPU unless configured otherwise,
+        # the plain HTTP port only forwards to HTTPS
+        supervisor.add_listener(
+            SimpleServer, True, settings('ssl port', 443), host,
+            workers=settings('workers', 0),
+            reuse_port=settings('reuse port', False),
+            backlog=settings('accept queue', 64)
+            )
+        supervisor.add_listener(
+            ForwardServer, False, settings('port', 80), host,
+            workers=settings('forward workers', 1),
+            reuse_port=settings('reuse port', False),
+            backlog=settings('accept queue', 64)
+            )
     else:
-        run_and_monitore_website(SimpleServer, False, settings('port', 80), F"http://{settings('host', '127.0.0.1')}:{settings('port', 80)}", 200, settings('host', '127.0.0.1'))
+        supervisor.add_listener(
+            SimpleServer, False, settings('port', 80), host,
+            workers=settings('workers', 0),
+            reuse_port=settings('reuse port', False),
+            backlog=settings('accept queue', 64)
+            )
+    supervisor.run()
@@ -0,0 +1,262 @@
+import asyncio
+import concurrent.futures
+import http.server as http
+import os
+
+
+class _LoopReader:
+    """
+    Blocking file-like reader used as rfile of a handler running in the executor.
+
+    The request line and headers read by the event loop are served from prefix, every
+    further read (the body) is handed to the event loop and fails with TimeoutError
+    when no data arrived for timeout seconds.
+    """
+    def __init__(self, reader: asyncio.StreamReader, loop: asyncio.AbstractEventLoop, prefix: bytes = b'',
+                 timeout: float = None):
+        self._reader = reader
+        self._loop = loop
+        self._buffer = prefix
+        self._timeout = timeout
+
+    def _run(self, coroutine):
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        try:
+            return future.result(self._timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError("timed out")
+
+    async def _readline(self, limit: int) -> bytes:
+        try:
+            return await self._reader.readuntil(b'\n')
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+        except asyncio.LimitOverrunError as e:
+            return await self._reader.read(min(e.consumed, limit) if limit >= 0 else e.consumed)
+
+    async def _read(self, size: int) -> bytes:
+        if size < 0:
+            return await self._reader.read(-1)
+        try:
+            return await self._reader.readexactly(size)
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+
+    def readline(self, limit: int = -1) -> bytes:
+        if self._buffer:
+            end = self._buffer.find(b'\n') + 1 or len(self._buffer)
+            if 0 <= limit < end:
+                end = limit
+            line, self._buffer = self._buffer[:end], self._buffer[end:]
+            if not line.endswith(b'\n') and not self._buffer and (limit < 0 or len(line) < limit):
+                line += self.readline(limit - len(line) if limit >= 0 else -1)
+            return line
+        line = self._run(self._readline(limit))
+        if 0 <= limit < len(line):
+            line, self._buffer = line[:limit], line[limit:]
+        return line
+
+    def read(self, size: int = -1) -> bytes:
+        data = b''
+        if self._buffer:
+            if size < 0:
+                data, self._buffer = self._buffer, b''
+            else:
+                data, self._buffer = self._buffer[:size], self._buffer[size:]
+                size -= len(data)
+                if size == 0:
+                    return data
+        return data + self._run(self._read(size))
+
+    def close(self):
+        pass
+
+
+class _LoopWriter:
+    """
+    Blocking file-like writer used as wfile of a handler running in the executor,
+    writes return once the event loop has accepted the data (flow control included).
+    A write that is not accepted within timeout seconds, e.g. because the client stopped
+    reading, aborts the connection and raises TimeoutError.
+    """
+    def __init__(self, writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop, timeout: float = None):
+        self._writer = writer
+        self._loop = loop
+        self._timeout = timeout
+
+    async def _write(self, data: bytes):
+        self._writer.write(data)
+        await self._writer.drain()
+
+    def write(self, data: bytes) -> int:
+        if data:
+            future = asyncio.run_coroutine_threadsafe(self._write(bytes(data)), self._loop)
+            try:
+                future.result(self._timeout)
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                self._loop.call_soon_threadsafe(self._writer.transport.abort)
+                raise TimeoutError("timed out")
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class AsyncHTTPServer(http.HTTPServer):
+    """
+    HTTPServer replacement that keeps connections in a single asyncio event loop.
+
+    Idle and slow connections only cost a coroutine waiting in the loop. Once the request
+    line and headers arrived, the normal request handler (SimpleServer, ForwardServer ...) handles the
+    request in a thread of the executor, so do_GET/do_POST/do_PUT and blocking addons
+    keep working unchanged.
+
+    Args:
+        server_address: (host, port) tuple to bind to.
+        RequestHandlerClass: the handler class.
+        workers (int): number of executor threads handling requests at the same time.
+        idle_timeout (float): seconds a connection may stay idle between requests, also the
+            time a client gets to send the headers of a request and each part of its body, and
+            to accept each part of the response.
+    """
+    ssl_context = None
+    # seconds a client gets for the TLS handshake
+    ssl_handshake_timeout = 10.0
+    # called with the ssl.SSLObject of every connection after its handshake, e.g. ServerTLS.count
+    on_handshake = None
+    line_limit = 65537
+    # header lines read on the event loop, one more than http.client accepts
+    max_header_lines = 101
+
+    def __init__(self, server_address, RequestHandlerClass, bind_and_activate: bool = True, *,
+                 workers: int = 16, idle_timeout: float = 15):
+        self.workers = max(1, int(workers))
+        self.idle_timeout = idle_timeout
+        self.connections = 0
+        self._loop = None
+        self._stop = None
+        self._draining = False
+        self._idle = set()
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            A dict with the number of open connections and executor threads.
+        """
+        return {'connections': self.connections, 'workers': self.workers}
+
+    async def _read_head(self, reader: asyncio.StreamReader, requestline: bytes) -> bytes:
+        """read the header block following requestline, up to and including the empty line"""
+        if len(requestline.split()) < 3:
+            # HTTP/0.9 requests have no headers
+            return requestline
+        head = [requestline]
+        for _ in range(self.max_header_lines):
+            line = await reader.readline()
+            head.append(line)
+            if line in (b'\r\n', b'\n', b''):
+                break
+        return b''.join(head)
+
+    def _make_handler(self, reader, writer, loop, head: bytes, requests_handled: int = 0):
+        """create a handler instance without running BaseRequestHandler.__init__, which would handle the request"""
+        handler = self.RequestHandlerClass.__new__(self.RequestHandlerClass)
+        handler.request = None
+        handler.connection = None
+        handler.client_address = writer.get_extra_info('peername') or ('', 0)
+        handler.server = self
+        handler.directory = os.getcwd()
+        handler.rfile = _LoopReader(reader, loop, head, self.idle_timeout)
+        handler.wfile = _LoopWriter(writer, loop, self.idle_timeout)
+        handler.close_connection = True
+        handler.requests_handled = requests_handled
+        return handler
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        self.connections += 1
+        requests_handled = 0
+        ssl_object = writer.get_extra_info('ssl_object')
+        if ssl_object is not None and self.on_handshake is not None:
+            self.on_handshake(ssl_object)
+        try:
+            while not self._draining:
+                task = asyncio.current_task()
+                self._idle.add(task)
+                try:
+                    requestline = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                except (asyncio.TimeoutError, ConnectionError, ValueError):
+                    break
+                finally:
+                    self._idle.discard(task)
+                if not requestline:
+                    break
+                # the handler thread is only taken once the complete header block arrived
+                try:
+                    head = await asyncio.wait_for(self._read_head(reader, requestline), self.idle_timeout)
+                except (asyncio.TimeoutError, ConnectionError, ValueError):
+                    break
+                handler = self._make_handler(reader, writer, loop, head, requests_handled)
+                requests_handled += 1
+                try:
+                    await loop.run_in_executor(self._executor, handler.handle_one_request)
+                except Exception:
+                    self.handle_error(None, handler.client_address)
+                    break
+                if handler.close_connection:
+                    break
+        finally:
+            self.connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        server = await asyncio.start_server(
+            self._handle_connection,
+            sock=self.socket,
+            ssl=self.ssl_context,
+            ssl_handshake_timeout=self.ssl_handshake_timeout if self.ssl_context is not None else None,
+            limit=self.line_limit
+            )
+        async with server:
+            while not self._stop.is_set():
+                self.service_actions()
+                try:
+                    await asyncio.wait_for(self._stop.wait(), self._poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            # stop accepting, close idle connections and let running requests finish
+            server.close()
+            self._draining = True
+            for task in list(self._idle):
+                task.cancel()
+            while self.connections:
+                await asyncio.sleep(0.05)
+
+    def serve_forever(self, poll_interval: float = 0.5):
+        """run the event loop until shutdown() is called, calling service_actions every poll_interval seconds"""
+        self._poll_interval = poll_interval
+        self._executor = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix='http-worker')
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._executor.shutdown(wait=False)
+
+    def shutdown(self):
+        """
+        Stop serve_forever once the requests being handled are finished, may be called from any thread.
+        Idle connections are closed right away.
+        """
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
@@ -0,0 +1,118 @@
+"""
+Measure the cold start of the server.
+
+    import          seconds to import SimpleServer in a fresh interpreter
+    first request   seconds from starting a server process until it answered its first request
+    slowest imports the modules with the largest cumulative import time (python -X importtime)
+
+Run it from the directory holding settings.txt, like the server itself:
+
+usage: python benchmarks/startup.py [-h] [--runs RUNS] [--top TOP] [--concurrency MODE]
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+from time import monotonic, sleep
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = """
+from time import perf_counter
+start = perf_counter()
+import SimpleServer
+print(perf_counter() - start)
+"""
+
+SERVER_SNIPPET = """
+import sys
+import SimpleServer
+SimpleServer.settings['concurrency'] = sys.argv[2]
+SimpleServer.run_server(SimpleServer.SimpleServer, False, int(sys.argv[1]), '127.0.0.1')
+"""
+
+
+def _environment() -> dict:
+    return {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, (ROOT, os.environ.get('PYTHONPATH'))))}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def measure_import() -> float:
+    """seconds to import SimpleServer, measured inside a fresh interpreter"""
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_SNIPPET], env=_environment())
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def measure_first_request(concurrency: str, timeout: float = 30) -> float:
+    """seconds from starting a server process until it answered a request"""
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    from supervisor import probe
+    port = _free_port()
+    start = monotonic()
+    process = subprocess.Popen(
+        [sys.executable, '-c', SERVER_SNIPPET, str(port), concurrency],
+        env=_environment(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+        )
+    try:
+        while not probe('127.0.0.1', port, timeout=1):
+            if process.poll() is not None:
+                raise RuntimeError(f"server exited with {process.returncode} before answering")
+            if monotonic() - start > timeout:
+                raise TimeoutError(f"server did not answer within {timeout}s")
+            sleep(0.001)
+        return monotonic() - start
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def slowest_imports(top: int) -> list[tuple[float, str]]:
+    """the top modules with the largest cumulative import time in seconds"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import SimpleServer'],
+        env=_environment(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True
+        )
+    modules = []
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.append((int(cumulative) / 1e6, name.rstrip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def report(name: str, samples: list[float]):
+    print(f"{name:<14} median {statistics.median(samples) * 1000:8.1f} ms"
+          f"   min {min(samples) * 1000:8.1f} ms   max {max(samples) * 1000:8.1f} ms   runs {len(samples)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="measure import time and first request latency of the server")
+    parser.add_argument('--runs', type=int, default=10, help="measurements per metric")
+    parser.add_argument('--top', type=int, default=10, help="number of slowest imports to list, 0 to skip")
+    parser.add_argument('--concurrency', default='threadpool', help="concurrency mode of the measured server")
+    args = parser.parse_args(argv)
+
+    report('import', [measure_import() for _ in range(args.runs)])
+    report('first request', [measure_first_request(args.concurrency) for _ in range(args.runs)])
+    if args.top:
+        print("slowest imports (cumulative):")
+        for seconds, name in slowest_imports(args.top):
+            print(f"    {seconds * 1000:8.1f} ms  {name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+import email.utils
+import os
+import threading
+from collections import OrderedDict
+
+
+class ByteLRUCache:
+    """
+    Least recently used cache limited by the summed size of its values in bytes.
+
+    Safe to share between the threads of a worker. The counters hits, misses and
+    evictions can be read through stats().
+
+    Args:
+        max_bytes (int): the maximum summed size of all cached values.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = int(max_bytes)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None, version=None):
+        """
+        Return the value stored for key and mark it as recently used.
+
+        Args:
+            key: the key to look up.
+            default: returned if the key is not cached.
+            version: if given, entries stored with another version are dropped and count as a miss.
+        """
+        with self._lock:
+            try:
+                value, size, entry_version = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if version is not None and entry_version != version:
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size: int = None, version=None) -> bool:
+        """
+        Store value under key, evicting the least recently used entries if needed.
+
+        Args:
+            key: any hashable key.
+            value: the value to cache.
+            size (int): the size to account for the value, len(value) if not given.
+            version: stored along the value, see get.
+
+        Returns:
+            False if the value alone is larger than the cache, True otherwise.
+        """
+        if size is None:
+            size = len(value)
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return False
+            self._entries[key] = (value, size, version)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            return True
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def pop(self, key):
+        """remove key from the cache if it is cached"""
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            A dict with the counters 'hits', 'misses', 'evictions' and the
+            current 'entries', 'bytes' and 'max bytes'.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max bytes': self.max_bytes,
+        }
+
+
+class StaticFileCache(ByteLRUCache):
+    """
+    In-memory cache for the content of small static files.
+
+    Entries are keyed by the absolute path and dropped as soon as the
+    modification time or size of the file differs from the cached one.
+
+    Args:
+        max_bytes (int): the maximum summed size of all cached files.
+        max_file_size (int): files larger than this are never cached.
+    """
+    def __init__(self, max_bytes: int, max_file_size: int):
+        super().__init__(max_bytes)
+        self.max_file_size = int(max_file_size)
+
+    def read(self, path: str, stat_result: os.stat_result = None):
+        """
+        Return the content of the file at path.
+
+        Args:
+            path (str): path of a regular file.
+            stat_result (os.stat_result): the result of os.stat(path) if already known.
+
+        Returns:
+            The content as bytes, or None if the file is too large to be cached
+            and should be streamed instead.
+
+        Raises:
+            OSError: if the file can not be read.
+        """
+        if stat_result is None:
+            stat_result = os.stat(path)
+        if stat_result.st_size > self.max_file_size:
+            return None
+        key = os.path.abspath(path)
+        version = (stat_result.st_mtime_ns, stat_result.st_size)
+        body = self.get(key, version=version)
+        if body is not None:
+            return body
+        with open(path, 'rb') as byte_file:
+            body = byte_file.read()
+        if len(body) == stat_result.st_size:
+            self.put(key, body, version=version)
+        return body
+
+
+class ValidatorIndex(ByteLRUCache):
+    """
+    Index of the cache validators (ETag and Last-Modified) of files.
+
+    Validators are derived from modification time and size, never from the file content,
+    and only recomputed when one of them changes. All workers compute the same validators
+    for the same file. The index holds at most max_entries files.
+
+    Args:
+        max_entries (int): the maximum number of indexed files.
+    """
+    def __init__(self, max_entries: int = 4096):
+        super().__init__(max_entries)
+
+    def get_validators(self, path: str, stat_result: os.stat_result) -> tuple[str, str]:
+        """
+        Returns:
+            The strong ETag and the Last-Modified date of the file at path.
+        """
+        key = os.path.abspath(path)
+        version = (stat_result.st_mtime_ns, stat_result.st_size)
+        validators = self.get(key, version=version)
+        if validators is None:
+            validators = (
+                '"%x-%x"' % version,
+                email.utils.formatdate(stat_result.st_mtime, usegmt=True)
+                )
+            self.put(key, validators, 1, version=version)
+        return validators
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """
+    Weak comparison of etag with the entity tags of an If-None-Match header.
+
+    Args:
+        header (str): the If-None-Match header, e.g. 'W/"1a-2b", "3c-4d"' or '*'.
+        etag (str): the current entity tag.
+    """
+    if header.strip() == '*':
+        return True
+    etag = etag.removeprefix('W/')
+    for tag in header.split(','):
+        if tag.strip().removeprefix('W/') == etag:
+            return True
+    return False
+
+
+def not_modified_since(header: str, mtime: float) -> bool:
+    """
+    True if a file last modified at mtime did not change since the date of an If-Modified-Since header.
+    Malformed dates count as modified.
+    """
+    try:
+        since = email.utils.parsedate_to_datetime(header)
+    except (TypeError, ValueError, IndexError):
+        return False
+    if since is None or since.tzinfo is None:
+        return False
+    return int(mtime) <= since.timestamp()
+
+
+def if_range_matches(header: str, etag: str, last_modified: str) -> bool:
+    """
+    True if the If-Range header still describes the current file, so a Range request may be served.
+
+    Entity tags must match strongly, dates must equal the Last-Modified date.
+    """
+    header = header.strip()
+    if header.startswith('W/'):
+        return False
+    if header.startswith('"'):
+        return header == etag
+    return header == last_modified
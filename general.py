@@ -1,4 +1,9 @@
+import contextlib
+import functools
 import os
+import re
+import time
+from string import Template as PlaceholderTemplate
 from html import escape
 
 
@@ -44,41 +49,265 @@ class CaseInsensitiveDict(dict):
             self.__setitem__(k, v)
 
 
+_UNCOMMENTED = re.compile(r'(?:[^#\\]|\\.)*\\?', re.S)
+
+
+class SettingsSnapshot:
+    """
+    Immutable, compiled state of the settings.
+
+    Keys are normalized once when the snapshot is built, so lookups with normalized
+    keys ('keep alive') are a single dict access, other spellings ('Keep  Alive') are
+    normalized on a miss. The real paths of all values naming a directory are resolved
+    in advance for get_path.
+
+    Args:
+        values (dict): the settings.
+        version (int): increased with every change of the settings.
+    """
+    __slots__ = ('_values', '_dirs', 'version')
+
+    def __init__(self, values: dict, version: int = 0):
+        self._values = {CaseInsensitiveDict._k(key): value for key, value in values.items()}
+        self._dirs = {
+            value: os.path.realpath(value)
+            for value in self._values.values() if isinstance(value, str) and value and os.path.isdir(value)
+            }
+        self.version = version
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            return self._values[CaseInsensitiveDict._k(key)]
+
+    def __contains__(self, key) -> bool:
+        return key in self._values or CaseInsensitiveDict._k(key) in self._values
+
+    def __call__(self, key, /, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def items(self):
+        return self._values.items()
+
+    def resolved_dir(self, key: str) -> str:
+        """the real path of the directory stored under key"""
+        value = self[key]
+        try:
+            return self._dirs[value]
+        except KeyError:
+            # not an existing directory when the snapshot was built
+            return os.path.realpath(value)
+
+    def get_path(self, key: str, *path):
+        start = self.resolved_dir(key)
+        target = os.path.join(start, *path)
+        target = os.path.realpath(target)
+        if target == start or target.startswith(os.path.join(start, '')):
+            return target
+        else:
+            raise PermissionError(target + ' outside of provided settings dir: ' + start)
+
+
 class Settings(CaseInsensitiveDict):
     """
     Setting class (Singleton unless clasified otherwise)
     supposed to be a dictionary of all settings
+
+    All lookups are answered by an immutable SettingsSnapshot, which is replaced
+    as a whole when settings change, so readers never see a half loaded state.
+    reload() re-reads settings.txt and its included files when one of them changed
+    on disk, values assigned at runtime are kept.
     """
     _instance = None
     def __new__(cls, *args, seperate_instance: bool = False, **kargs):
         if seperate_instance:
-            return super().__new__(cls, **kargs)
+            instance = super().__new__(cls, **kargs)
         elif cls._instance == None:
-            cls._instance = super().__new__(cls, **kargs)
-            return cls._instance
+            cls._instance = instance = super().__new__(cls, **kargs)
         else:
             return cls._instance
+        instance.__dict__.update(_snapshot=SettingsSnapshot({}), _args=[], _sources={}, _overrides={}, _load_depth=0)
+        return instance
 
     def __init__(self, *args, seperate_instance: bool = False, **kargs):
-        super().__init__(self, **kargs)
-        for arg in args:
-            if isinstance(arg, str):
-                self.from_string(arg, may_be_file=True)
-            elif isinstance(arg, dict):
-                for key, value in arg.items():
-                    self[key] = value
-            elif isinstance(arg, (list, tuple)):
-                if len(arg) == 2:
-                    self[arg[0]] = arg[1]
-                else:
-                    raise ValueError("arguments given as list should be length of two")
+        if not args and not kargs and self._snapshot.version:
+            return  # Settings() only returns the loaded singleton
+        with self._load():
+            super().__init__(self, **kargs)
+            for arg in args:
+                self._args.append(arg)
+                self._apply(arg)
+
+    def _apply(self, arg):
+        if isinstance(arg, str):
+            self.from_string(arg, may_be_file=True)
+        elif isinstance(arg, dict):
+            for key, value in arg.items():
+                self[key] = value
+        elif isinstance(arg, (list, tuple)):
+            if len(arg) == 2:
+                self[arg[0]] = arg[1]
             else:
-                raise TypeError("arguments should be of type str, list, tuple or dict")
+                raise ValueError("arguments given as list should be length of two")
+        else:
+            raise TypeError("arguments should be of type str, list, tuple or dict")
+
+    @contextlib.contextmanager
+    def _load(self):
+        """assignments inside are no runtime overrides, the snapshot is compiled once at the end"""
+        self.__dict__['_load_depth'] += 1
+        try:
+            yield
+        finally:
+            self.__dict__['_load_depth'] -= 1
+            if not self._load_depth:
+                self._compile()
+
+    def _compile(self):
+        self.__dict__['_snapshot'] = SettingsSnapshot(dict(self.items()), self._snapshot.version + 1)
+
+    @classmethod
+    def instance(cls):
+        """the singleton, without reading any settings again"""
+        if cls._instance is None:
+            return cls()
+        return cls._instance
+
+    @property
+    def snapshot(self) -> SettingsSnapshot:
+        """the current compiled settings, unaffected by later changes"""
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        """increased by every change of the settings"""
+        return self._snapshot.version
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if not self._load_depth:
+            self._overrides[self._k(key)] = value
+            self._compile()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._overrides.pop(self._k(key), None)
+        if not self._load_depth:
+            self._compile()
+
+    def update(self, E={}, **F):
+        with self._load():
+            for key, value in {**dict(E), **F}.items():
+                self[key] = value
+                self._overrides[self._k(key)] = value
+
+    def pop(self, key, *args):
+        if key not in self:
+            return dict.pop(self, self._k(key), *args)
+        value = self[key]
+        del self[key]
+        return value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.update({key: default})
+        return self[key]
+
+    def __getitem__(self, key):
+        return self._snapshot[key]
+
+    def __contains__(self, key):
+        return key in self._snapshot
+
+    def get(self, key, default=None):
+        return self._snapshot(key, default)
+
+    def __call__(self, key, /, default=None):
+        snapshot = self._snapshot
+        try:
+            return snapshot._values[key]
+        except KeyError:
+            return snapshot(key, default)
+
+    def get_path(self, key: str, *path):
+        return self._snapshot.get_path(key, *path)
+
+    def resolved_dir(self, key: str) -> str:
+        """
+        Return the real path of the directory stored under key.
+
+        The paths of all configured directories are resolved when the settings are compiled,
+        so only the requested path has to be resolved on each call of get_path.
+        """
+        return self._snapshot.resolved_dir(key)
+
+    def changed_on_disk(self) -> bool:
+        """True if a settings file was modified, created or removed since it was read"""
+        for path, mtime in self._sources.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                if mtime is not None:
+                    return True
+        return False
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Read the settings files again if one of them changed, see changed_on_disk.
+
+        The new settings are parsed into a separate instance and replace the current
+        ones at once. If they can not be parsed, the current settings are kept.
+
+        Returns:
+            True if the settings were replaced.
+        """
+        if not force and not self.changed_on_disk():
+            return False
+        fresh = Settings(seperate_instance=True)
+        try:
+            with fresh._load():
+                for arg in self._args:
+                    fresh._apply(arg)
+                for key, value in self._overrides.items():
+                    fresh[key] = value
+        except Exception as e:
+            print("WARNING unable to reload settings, keeping the current ones:", e)
+            # do not retry until the files change again
+            self.__dict__['_sources'] = {**self._sources, **fresh._sources}
+            return False
+        with self._load():
+            dict.clear(self)
+            dict.update(self, fresh)
+            self.__dict__['_sources'] = fresh._sources
+        return True
+
+    def reload_if_due(self, interval: float) -> bool:
+        """reload, but check the files at most once per interval seconds"""
+        now = time.monotonic()
+        if now < self.__dict__.get('_next_check', 0):
+            return False
+        self.__dict__['_next_check'] = now + interval
+        return self.reload()
 
     def from_file(self, filepath: str):
+        try:
+            self._sources[os.path.abspath(filepath)] = os.stat(filepath).st_mtime_ns
+        except OSError:
+            self._sources[os.path.abspath(filepath)] = None
         with open(filepath, 'r') as file:
-            for line in file.readlines():
-                line = line.replace('\n', '').replace('\r', '').strip()
+            for line in file:
+                line = line.strip()
                 if line.startswith('include '):
                     self.from_string(line[8:], is_file=True)
                 else:
@@ -88,27 +317,20 @@ class Settings(CaseInsensitiveDict):
         if string.strip() == "":
             return
         elif is_file:
-            self.from_file(string)
+            with self._load():
+                self.from_file(string)
         elif may_be_file and os.path.isfile(string):
-            self.from_file(string)
+            with self._load():
+                self.from_file(string)
         else:
-            tmp = ''
-            flag = False
-            for char in string:
-                if char == '\\':
-                    flag = True
-                    tmp += char
-                elif flag:
-                    tmp += char
-                    flag = False
-                elif char == '#':
-                    break
-                else:
-                    tmp += char
-            string = tmp
-            del flag
-            del tmp
-            key, value = string.split('=')
+            # everything after an unescaped '#' is a comment, escapes are kept as they are
+            if '#' in string:
+                string = _UNCOMMENTED.match(string).group(0)
+            if string.strip() == "":
+                return
+            key, separator, value = string.partition('=')
+            if not separator:
+                raise ValueError("expected 'key = value', got: " + string.strip())
             key = key.strip()
             value = value.strip()
             if key.strip() != "" and key[0] in ('\'', '\"') and key[-1] == key[0]:
@@ -118,21 +340,6 @@ class Settings(CaseInsensitiveDict):
 
             self[key] = type_string(value)
 
-    def get_path(self, key: str, *path):
-        start = os.path.realpath(self[key])
-        target = os.path.join(start, *path)
-        target = os.path.realpath(target)
-        if target.startswith(start):
-            return target
-        else:
-            raise PermissionError(target + ' outside of provided settings dir: ' + start)
-
-    def __call__(self, key, /, default=None):
-        if key in self:
-            return self[key]
-        else:
-            return default
-
 
 def isEmpty(string:str)->bool:
     if string == None:
@@ -166,18 +373,112 @@ def type_string(value: str) -> str:
     return result
 
 
+class Template:
+    """
+    HTML template with $name or ${name} placeholders, see string.Template.
+
+    The text is split into literal parts and placeholders once, rendering only joins them.
+    Values are escaped unless their name is listed in raw, '$$' is a literal '$', like any
+    '$' that does not start a valid placeholder (e.g. in '$5' or '$(...)').
+
+    Args:
+        text (str): the template.
+        name (str): name used in error messages.
+    """
+    def __init__(self, text: str, name: str = '<string>'):
+        self.name = name
+        self._parts = []
+        position = 0
+        for match in PlaceholderTemplate.pattern.finditer(text):
+            self._parts.append(text[position:match.start()])
+            if match.group('escaped') is not None or match.group('invalid') is not None:
+                self._parts.append('$')
+            else:
+                self._parts.append((match.group('named') or match.group('braced'),))
+            position = match.end()
+        self._parts.append(text[position:])
+        self._parts = [part for part in self._parts if part != '']
+
+    def render(self, values: dict, raw=()) -> str:
+        """
+        Raises:
+            KeyError: if a placeholder has no value.
+        """
+        return ''.join(
+            part if isinstance(part, str) else (
+                str(values[part[0]]) if part[0] in raw else escape(str(values[part[0]])))
+            for part in self._parts
+            )
+
+
+templates = {}
+
+
+def load_templates(directory: str) -> dict:
+    """
+    Read and parse all .html files below directory once, e.g. at startup.
+
+    They are available to html_compiler.append_template by their path relative
+    to directory without extension, e.g. 'upload' for upload.html. Files that can
+    not be read are skipped with a warning.
+
+    Returns:
+        The dict of all loaded templates.
+    """
+    for root, _, names in os.walk(directory):
+        for filename in names:
+            if not filename.endswith('.html'):
+                continue
+            path = os.path.join(root, filename)
+            name = os.path.splitext(os.path.relpath(path, directory))[0].replace(os.sep, '/')
+            try:
+                with open(path, 'r', encoding='UTF-8') as file:
+                    templates[name] = Template(file.read(), name)
+            except (OSError, ValueError) as e:
+                print(f"WARNING unable to load the template {name}, skipping it:", e)
+    return templates
+
+
+def cached_page(handler):
+    """
+    Decorator for route handlers of pages that only depend on the settings and the
+    path parameters, like the index page.
+
+    The page is rendered with html_compiler once per settings version and sent from the
+    render cache of SimpleServer as ready-made (compressed) bytes afterwards.
+    The handler must not read anything else of the request.
+    """
+    page_id = f"{handler.__module__}.{handler.__qualname__}"
+
+    @functools.wraps(handler)
+    def wrapper(server, **params):
+        key = (page_id, tuple(sorted((name, tuple(value) if isinstance(value, list) else value)
+                                     for name, value in params.items())))
+
+        def render():
+            server.page_capture = page = {}
+            try:
+                handler(server, **params)
+            finally:
+                server.page_capture = None
+            return page.get('html'), page.get('status', 200)
+        return server.return_cached(key, render, content_type='text/html; charset=UTF-8')
+    return wrapper
+
+
 class html_compiler:
     title = ""
     lang = "en_US"
     favicon = "/favicon"
-    _body = ""
     footer = ""
     header = "<h1>%(title)s<h1>"
 
     def __init__(self, server, status: int = 200, **send_headers):
         self.server = server
-        self.settings = Settings()
+        self.settings = Settings.instance()
+        self.servername = self.settings('Servername', 'Python-WebServer-Template')
         self.css = []
+        self._body = []
         for a, b in send_headers.items():
             self.server.send_header(a, b)
         self.status = status
@@ -188,32 +489,63 @@ class html_compiler:
     def append_body(self, string, do_escape=False):
         if do_escape:
             string = escape(string)
-        self._body += string
+        self._body.append(string)
 
-    def __str__(self):
-        html = F"<!DOCTYPE html>\n<html lang=\"{escape(self.lang)}\">\n"
-        self.server.send_header('charset', 'UTF-8')
-        self.server.send_header('Charset', 'UTF-8')
-        html += F"""<head>
+    def append_template(self, template: str, /, raw=(), **values):
+        """append the template (see load_templates) rendered with values, names in raw are not escaped"""
+        self._body.append(templates[template].render(values, raw))
+
+    @property
+    def body(self) -> str:
+        return "".join(self._body)
+
+    def iter_parts(self):
+        """
+        Yield the page in parts: the document head first, then the body and the end of the document.
+        """
+        html = [
+            F"<!DOCTYPE html>\n<html lang=\"{escape(self.lang)}\">\n",
+            F"""<head>
         <meta charset=\"UTF-8\">
         <link rel=\"icon\" href=\"{escape(self.favicon)}\">
         <link rel=\"shortcut icon\" href=\"{escape(self.favicon)}\">
         <link rel=\"stylesheet\" href=\"/css\">"""
+            ]
         for css in self.css:
-            html += "<link rel=\"stylesheet\" href=\"" + escape(os.path.join("/css", css)) + "\">"
-        html += F"<title>{Settings()('Servername', 'Python-WebServer-Template')} - {escape(self.title)}</title></head><body>"
+            html.append("<link rel=\"stylesheet\" href=\"" + escape(os.path.join("/css", css)) + "\">")
+        html.append(F"<title>{self.servername} - {escape(self.title)}</title></head><body>")
+        yield "".join(html)
+        html = []
         if self.header != "":
-            html += "<header>" + self.header % {'title': escape(self.title), 'location': escape(self.server.path)} + "</header>"
-        html += self._body
+            html.append("<header>" + self.header % {'title': escape(self.title), 'location': escape(self.server.path)} + "</header>")
+        html.extend(self._body)
         if self.footer != "":
-            html += "<footer>" + self.footer + "</footer>"
-        html += "</body></html>"
-        return html
+            html.append("<footer>" + self.footer + "</footer>")
+        html.append("</body></html>")
+        yield "".join(html)
+
+    def __str__(self):
+        return "".join(self.iter_parts())
+
+    def _send_headers(self):
+        if self.server.search_header('Content-Type', case_sensitive=False) is None:
+            self.server.send_header('Content-Type', 'text/html; charset=UTF-8')
 
     def send(self):
         html = str(self)
+        self._send_headers()
+        capture = getattr(self.server, 'page_capture', None)
+        if capture is not None:
+            # rendered for the render cache, see cached_page
+            capture.update(html=html, status=self.status)
+            return
         self.server.return_string(html, content_type='text/html', status=self.status)
 
+    def stream(self):
+        """send the page with SimpleServer.return_stream, the document head goes out before the body is rendered"""
+        self._send_headers()
+        self.server.return_stream(self.iter_parts(), content_type='text/html', status=self.status)
+
     def set_status(self, status: int):
         self.status = int(status)
 
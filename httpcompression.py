@@ -0,0 +1,326 @@
+import functools
+import hashlib
+import os
+import stat
+from typing import List
+
+try:
+    from compression import zstd  # standard library since Python 3.14
+except ImportError:
+    zstd = None
+
+# content encodings compress_data can produce, besides 'identity'
+SUPPORTED_ENCODINGS = ('gzip', 'deflate', 'compress') + (('zstd',) if zstd is not None else ())
+# file extensions of precompressed sidecar files per content encoding
+PRECOMPRESSED_EXTENSIONS = {
+    'gzip': '.gz',
+    'deflate': '.zz',
+}
+if zstd is not None:
+    PRECOMPRESSED_EXTENSIONS['zstd'] = '.zst'
+# zlib wbits producing the container format of each encoding
+_WBITS = {
+    'gzip': 31,
+    'deflate': 15,
+    'compress': 15,
+}
+# media types that are compressed / never compressed unless configured otherwise
+DEFAULT_COMPRESS_TYPES = (
+    'text/*', 'application/json', 'application/javascript', 'application/xml', 'application/xhtml+xml',
+    'application/manifest+json', 'application/wasm', 'image/svg+xml', 'image/x-icon', 'image/vnd.microsoft.icon',
+)
+DEFAULT_EXCLUDE_TYPES = (
+    'image/*', 'video/*', 'audio/*', 'font/woff', 'font/woff2', 'application/zip', 'application/gzip',
+    'application/x-gzip', 'application/x-bzip2', 'application/x-xz', 'application/zstd', 'application/x-7z-compressed',
+    'application/x-rar-compressed', 'application/pdf',
+)
+
+
+@functools.lru_cache(maxsize=256)
+def parse_accept_encoding_header(header: str) -> List[str]:
+    """
+    Parse the given Accept-Encoding header string and return a list of
+    encodings ordered by their qvalues weighting.
+
+    Encodings with q=0 are not acceptable to the client and left out,
+    malformed qvalues count as q=0. The results of the most recent headers are
+    memoized in a bounded cache, the returned list must not be modified.
+
+    Args:
+        header (str): The Accept-Encoding header string.
+
+    Returns:
+        A list of encoding names ordered by their qvalues.
+
+    Example:
+        >>> header = 'gzip, deflate;q=0.5, br;q=0.1'
+        >>> parse_accept_encoding(header)
+        ['gzip', 'deflate', 'br']
+    """
+    encodings = [('identity', 0.01)]  # A list of encoding names with their qvalues
+    if header:
+        parts = header.split(',')
+        for part in parts:
+            encoding, _, params = part.strip().partition(';')
+            qvalue = 1.0
+            for param in params.split(';'):
+                key, _, value = param.strip().partition('=')
+                if key == 'q':
+                    try:
+                        qvalue = float(value)
+                    except ValueError:
+                        qvalue = 0
+            if qvalue > 0:
+                encodings.append((encoding.strip().lower(), qvalue))
+    encodings.sort(key=lambda x: x[1], reverse=True)
+    return [encoding for encoding, _ in encodings]
+
+
+@functools.lru_cache(maxsize=256)
+def _negotiate(encodings: tuple) -> str:
+    for encoding in encodings:
+        if encoding == '*':
+            return 'gzip'
+        elif encoding in SUPPORTED_ENCODINGS or encoding == 'identity':
+            return encoding
+    return 'identity'
+
+
+def negotiate_encoding(encodings: List[str]) -> str:
+    """
+    Return the content encoding compress_data would choose for the parsed Accept-Encoding header.
+
+    The result is memoized in a bounded cache.
+
+    Args:
+        encodings (List of str): The parsed Accept-Encoding header sent by the client.
+
+    Returns:
+        The name of the encoding, 'identity' if none of the encodings is supported.
+    """
+    return _negotiate(tuple(encodings))
+
+
+def _match_type(content_type: str, patterns: dict):
+    """return the value of the most specific pattern ('text/html', 'text/*', '*') matching content_type"""
+    if content_type in patterns:
+        return patterns[content_type]
+    wildcard = content_type.split('/')[0] + '/*'
+    if wildcard in patterns:
+        return patterns[wildcard]
+    return patterns.get('*')
+
+
+class CompressionPolicy:
+    """
+    Decides which responses are worth compressing and with which level.
+
+    Args:
+        min_size (int): bodies smaller than this are sent uncompressed.
+        types: media types to compress, 'text/*' style wildcards are allowed.
+        exclude_types: media types never to compress, e.g. images and archives that are compressed already.
+            A more specific entry wins over a wildcard, on equal terms the exclusion wins.
+        level (int): the compression level.
+        levels (dict): compression levels per media type (wildcards allowed), overriding level.
+    """
+    def __init__(self, min_size: int = 256, types=DEFAULT_COMPRESS_TYPES, exclude_types=DEFAULT_EXCLUDE_TYPES,
+                 level: int = 6, levels: dict = None):
+        self.min_size = int(min_size)
+        self.level = int(level)
+        self.levels = {key.strip().lower(): int(value) for key, value in (levels or {}).items()}
+        self._types = {}
+        for media_type in types:
+            self._types[media_type.strip().lower()] = True
+        for media_type in exclude_types:
+            self._types[media_type.strip().lower()] = False
+
+    @classmethod
+    def from_settings(cls, settings) -> 'CompressionPolicy':
+        """
+        Build the policy from the settings 'compress min size', 'compress types', 'compress exclude types'
+        (comma separated lists), 'compress level' and 'compress level <media type>'.
+        """
+        def as_list(value, default):
+            if value is None:
+                return default
+            return [item for item in str(value).split(',') if item.strip() != '']
+
+        levels = {}
+        for key, value in settings.items():
+            if isinstance(key, str) and key.startswith('compress level '):
+                levels[key[len('compress level '):]] = value
+        return cls(
+            min_size=settings('compress min size', 256),
+            types=as_list(settings('compress types'), DEFAULT_COMPRESS_TYPES),
+            exclude_types=as_list(settings('compress exclude types'), DEFAULT_EXCLUDE_TYPES),
+            level=settings('compress level', 6),
+            levels=levels,
+            )
+
+    @staticmethod
+    def _media_type(content_type: str) -> str:
+        return (content_type or '').split(';')[0].strip().lower()
+
+    def should_compress(self, content_type: str, size: int) -> bool:
+        """True if a body of size bytes and the given Content-Type should be compressed"""
+        if size < self.min_size:
+            return False
+        return bool(_match_type(self._media_type(content_type), self._types))
+
+    def compressible(self, content_type: str) -> bool:
+        """True if bodies of the given Content-Type should be compressed, whatever their size"""
+        return bool(_match_type(self._media_type(content_type), self._types))
+
+    def level_for(self, content_type: str) -> int:
+        """the compression level for the given Content-Type"""
+        level = _match_type(self._media_type(content_type), self.levels)
+        return self.level if level is None else level
+
+
+def encode(data: bytes, encoding: str, level: int = 9) -> bytes:
+    """
+    Compress data with the given content encoding.
+
+    Args:
+        data (bytes): The bytes object to compress.
+        encoding (str): One of 'gzip', 'compress', 'deflate', 'zstd' or 'identity'.
+        level (int): The compression level.
+
+    Returns:
+        The compressed bytes object.
+    """
+    # imported on first use, most workers start without compressing anything
+    import zlib
+    if encoding == 'gzip':
+        import gzip
+        return gzip.compress(data, compresslevel=level)
+    elif encoding == 'compress':
+        return zlib.compress(data, level=level)
+    elif encoding == 'deflate':
+        compressobj = zlib.compressobj(level=level, method=zlib.DEFLATED, wbits=15)
+        return compressobj.compress(data) + compressobj.flush()  # compress the data using Deflate
+    elif encoding == 'zstd' and zstd is not None:
+        return zstd.compress(data, level=level)
+    elif encoding == 'identity':
+        return data
+    raise ValueError("unsupported content encoding: " + encoding)
+
+
+def compress_data(data: bytes, encodings: List[str] = ['identity',], *, cache=None, key=None, version=None,
+                  policy: CompressionPolicy = None, content_type: str = None) -> tuple[bytes, str]:
+    """
+    Compress the given bytes object using the specified encoding.
+
+    If a policy is given, bodies it does not consider worth compressing are returned unchanged
+    and the level is taken from it, otherwise level 9 is used.
+    If a cache is given, compressed variants are looked up in it first and stored
+    after compressing, so repeated responses with the same content skip compression.
+
+    Args:
+        data (bytes): The bytes object to compress.
+        encodings (List of str): The parsed Accept-Encoding header sent by the client.
+        cache (caching.ByteLRUCache): optional cache for compressed variants.
+        key: identity of the content, e.g. the path of a file. Defaults to a hash of data.
+        version: version of the content under key, e.g. mtime and size of the file.
+        policy (CompressionPolicy): optional policy deciding whether and how strong to compress.
+        content_type (str): the Content-Type of data, used by the policy.
+
+    Returns:
+        The compressed bytes object and the name of the used encoding.
+    """
+    encoding = negotiate_encoding(encodings)
+    if encoding == 'identity':
+        return data, encoding
+    level = 9
+    if policy is not None:
+        if not policy.should_compress(content_type, len(data)):
+            return data, 'identity'
+        level = policy.level_for(content_type)
+    if cache is None:
+        return encode(data, encoding, level), encoding
+    if key is None:
+        key = hashlib.blake2b(data, digest_size=16).digest()
+    compressed = cache.get((key, encoding, level), version=version)
+    if compressed is None:
+        compressed = encode(data, encoding, level)
+        cache.put((key, encoding, level), compressed, version=version)
+    return compressed, encoding
+
+
+def compressobj(encoding: str, level: int = 9):
+    """
+    Return a compressor object producing the given content encoding, for incremental compression.
+
+    Args:
+        encoding (str): 'gzip', 'deflate', 'compress' or 'zstd'.
+        level (int): the compression level.
+
+    Returns:
+        An object with the methods compress(data) and flush(), like zlib.compressobj.
+    """
+    if encoding == 'zstd' and zstd is not None:
+        return zstd.ZstdCompressor(level=level)
+    import zlib
+    return zlib.compressobj(level=level, method=zlib.DEFLATED, wbits=_WBITS[encoding])
+
+
+class StreamCompressor:
+    """
+    Incremental compressor for streamed responses.
+
+    The output of every compress call ends on a flush point, so the client can
+    decompress everything sent so far without waiting for the rest of the body.
+
+    Args:
+        encoding (str): the content encoding, 'identity' passes the data through.
+        level (int): the compression level.
+    """
+    def __init__(self, encoding: str, level: int = 6):
+        self.encoding = encoding
+        self._compressor = None if encoding == 'identity' else compressobj(encoding, level)
+
+    def compress(self, data: bytes) -> bytes:
+        if self._compressor is None:
+            return data
+        if self.encoding == 'zstd':
+            return self._compressor.compress(data, zstd.ZstdCompressor.FLUSH_BLOCK)
+        import zlib
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        """return the end of the compressed stream"""
+        if self._compressor is None:
+            return b''
+        return self._compressor.flush()
+
+
+def find_precompressed(path: str, stat_result: os.stat_result, encodings: List[str]):
+    """
+    Look for a precompressed sidecar of path (e.g. foo.css.gz for foo.css) the client accepts.
+
+    The encodings are tried in the order of the client's preference, a sidecar is
+    only used if it is at least as new as the file itself.
+
+    Args:
+        path (str): path of the original file.
+        stat_result (os.stat_result): os.stat of the original file.
+        encodings (List of str): The parsed Accept-Encoding header sent by the client.
+
+    Returns:
+        A tuple (sidecar path, encoding, os.stat of the sidecar) or None.
+    """
+    for encoding in encodings:
+        if encoding == '*':
+            encoding = 'gzip'
+        elif encoding == 'identity':
+            return None
+        extension = PRECOMPRESSED_EXTENSIONS.get(encoding)
+        if extension is None:
+            continue
+        try:
+            sidecar_stat = os.stat(path + extension)
+        except OSError:
+            continue
+        if stat.S_ISREG(sidecar_stat.st_mode) and sidecar_stat.st_mtime_ns >= stat_result.st_mtime_ns:
+            return path + extension, encoding, sidecar_stat
+    return None
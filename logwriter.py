@@ -0,0 +1,195 @@
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from time import monotonic
+
+_STOP = object()
+
+
+class LogWriter:
+    """
+    Writes log records to a file from a background thread.
+
+    Records are put into a bounded queue and never block the caller: if the queue
+    is full the record is dropped and counted in dropped. The writer thread collects
+    records and writes them in batches, once batch_bytes are buffered or flush_interval
+    seconds after the first buffered record. The file is rotated when it grows beyond
+    max_bytes (log.log -> log.log.1 -> log.log.2 ...), files rotated by another worker
+    process are noticed and reopened.
+
+    Args:
+        path (str): the log file.
+        structured (bool): write JSON lines instead of the classic access log format.
+        echo (bool): also write every record to stdout.
+        max_queue (int): the maximum number of records waiting to be written.
+        batch_bytes (int): write once this many bytes are buffered.
+        flush_interval (float): write at the latest this many seconds after a record arrived.
+        max_bytes (int): rotate the file once it is larger, 0 disables rotation.
+        backups (int): the number of rotated files to keep.
+    """
+    def __init__(self, path: str, *, structured: bool = False, echo: bool = False, max_queue: int = 10000,
+                 batch_bytes: int = 2 ** 16, flush_interval: float = 1.0, max_bytes: int = 2 ** 24, backups: int = 5):
+        self.path = path
+        self.structured = structured
+        self.echo = echo
+        self.max_queue = max_queue
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.written = 0
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # a forked worker inherits the object but not the thread, it needs its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(self.max_queue)
+                    self._file = None
+                    self._thread = threading.Thread(target=self._run, name=f"log writer {self.path}", daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    def log(self, client: str, message: str, **fields):
+        """
+        Queue a record for writing, without waiting for any I/O.
+
+        Args:
+            client (str): the address of the client.
+            message (str): the log message.
+            fields: additional fields, only written in the structured format.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((time.time(), client, message, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def format(self, record: tuple) -> str:
+        timestamp, client, message, fields = record
+        if self.structured:
+            return json.dumps({
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(timestamp)),
+                'client': client,
+                'message': message,
+                **fields,
+                }) + '\n'
+        return f"{client} - - [{time.strftime('%d/%b/%Y %H:%M:%S', time.localtime(timestamp))}] {message}\n"
+
+    def _run(self):
+        buffer = []
+        size = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - monotonic())
+            try:
+                record = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                record = None
+            if record is _STOP:
+                if buffer:
+                    self._write(''.join(buffer))
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+            if record is not None:
+                line = self.format(record)
+                buffer.append(line)
+                size += len(line)
+                if deadline is None:
+                    deadline = monotonic() + self.flush_interval
+            if buffer and (size >= self.batch_bytes or monotonic() >= deadline):
+                self._write(''.join(buffer))
+                self.written += len(buffer)
+                buffer = []
+                size = 0
+                deadline = None
+
+    def _open(self):
+        if self._file is not None:
+            try:
+                if os.stat(self.path).st_ino == os.fstat(self._file.fileno()).st_ino:
+                    return
+            except OSError:
+                pass
+            self._file.close()
+        self._file = open(self.path, 'a', encoding='UTF-8')
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def _write(self, data: str):
+        try:
+            self._open()
+            self._file.write(data)
+            self._file.flush()
+            if self.max_bytes and self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            print("WARNING unable to write log file", self.path, e, file=sys.stderr)
+            self._file = None
+        if self.echo:
+            sys.stdout.write(data)
+            sys.stdout.flush()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            A dict with the number of 'written', 'dropped' and currently 'queued' records.
+        """
+        return {
+            'written': self.written,
+            'dropped': self.dropped,
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+        }
+
+    def close(self, timeout: float = 5):
+        """write all queued records and stop the writer thread"""
+        if self._pid == os.getpid() and self._thread is not None:
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+        self._pid = None
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_log_writer(path: str, **kwargs) -> LogWriter:
+    """
+    Return the LogWriter of the given file, creating it with kwargs (see LogWriter) on first use.
+    """
+    try:
+        return _writers[path]
+    except KeyError:
+        with _writers_lock:
+            if path not in _writers:
+                _writers[path] = LogWriter(path, **kwargs)
+            return _writers[path]
+
+
+def close_log_writers():
+    """write everything still queued, e.g. before a worker exits"""
+    for writer in list(_writers.values()):
+        writer.close()
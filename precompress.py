@@ -0,0 +1,110 @@
+"""
+Write precompressed sidecar files next to the static files, e.g. default.css.gz for default.css.
+
+SimpleServer.return_file sends these instead of compressing the file on each request.
+Run it again after changing static files, sidecars older than their file are ignored by the server.
+
+usage: python precompress.py [-h] [--workers WORKERS] [--min-size MIN_SIZE] [--level LEVEL] [directory ...]
+"""
+import argparse
+import mimetypes
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from general import Settings
+from httpcompression import PRECOMPRESSED_EXTENSIONS, CompressionPolicy, compressobj
+
+CHUNK_SIZE = 2 ** 16
+
+
+def precompress_file(path: str, level: int = 9) -> list[str]:
+    """
+    Write all sidecars of the file at path that are missing or older than the file.
+
+    Sidecars that would not be smaller than the file itself (images, archives ...) are not written.
+
+    Args:
+        path (str): the file to compress.
+        level (int): the compression level.
+
+    Returns:
+        The list of written sidecar paths.
+    """
+    written = []
+    file_stat = os.stat(path)
+    for encoding, extension in PRECOMPRESSED_EXTENSIONS.items():
+        target = path + extension
+        try:
+            if os.stat(target).st_mtime_ns >= file_stat.st_mtime_ns:
+                continue
+        except FileNotFoundError:
+            pass
+        tmp = f"{target}.{os.getpid()}.tmp"
+        compressor = compressobj(encoding, level)
+        size = 0
+        try:
+            with open(path, 'rb') as source, open(tmp, 'wb') as sidecar:
+                while chunk := source.read(CHUNK_SIZE):
+                    data = compressor.compress(chunk)
+                    size += len(data)
+                    sidecar.write(data)
+                data = compressor.flush()
+                size += len(data)
+                sidecar.write(data)
+            if size < file_stat.st_size:
+                os.replace(tmp, target)
+                written.append(target)
+            else:
+                os.remove(tmp)
+                if os.path.exists(target):
+                    os.remove(target)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    return written
+
+
+def find_files(directories: list[str], policy: CompressionPolicy):
+    """yield all regular files below directories that are no sidecars themselves and worth compressing"""
+    extensions = tuple(PRECOMPRESSED_EXTENSIONS.values())
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if name.endswith(extensions) or name.endswith('.tmp') or not os.path.isfile(path):
+                    continue
+                content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+                if policy.should_compress(content_type, os.path.getsize(path)):
+                    yield path
+
+
+def main(argv=None):
+    settings = Settings('settings.txt')
+    parser = argparse.ArgumentParser(description="write precompressed sidecar files for the static directories")
+    parser.add_argument(
+        'directories', nargs='*',
+        help="directories to walk, defaults to the 'fileroot', 'css dir' and 'well-known' settings"
+        )
+    parser.add_argument('--workers', type=int, default=None, help="number of processes, defaults to the CPU count")
+    parser.add_argument('--min-size', type=int, default=None, help="skip smaller files, overrides 'compress min size'")
+    parser.add_argument('--level', type=int, default=9, help="compression level")
+    args = parser.parse_args(argv)
+
+    directories = args.directories
+    if not directories:
+        directories = [settings[key] for key in ('fileroot', 'css dir', 'well-known') if key in settings]
+    directories = [directory for directory in directories if os.path.isdir(directory)]
+
+    with ProcessPoolExecutor(args.workers) as executor:
+        policy = CompressionPolicy.from_settings(settings)
+        if args.min_size is not None:
+            policy.min_size = args.min_size
+        paths = list(find_files(directories, policy))
+        for path, written in zip(paths, executor.map(precompress_file, paths, [args.level] * len(paths))):
+            for target in written:
+                print(target)
+
+
+if __name__ == '__main__':
+    main()
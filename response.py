@@ -0,0 +1,60 @@
+class HeaderMap:
+    """
+    Response headers with case-insensitive lookups in constant time.
+
+    Headers keep the spelling and order they were added in, headers with the same
+    name (e.g. Set-Cookie) are kept together in the order of the first one.
+    """
+    def __init__(self):
+        self._headers = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name.lower() in self._headers
+
+    def __len__(self):
+        return sum(len(values) for values in self._headers.values())
+
+    def __iter__(self):
+        """yield (name, value) tuples"""
+        for values in self._headers.values():
+            yield from values
+
+    def add(self, name: str, value):
+        """add a header, keeping previous headers of the same name"""
+        self._headers.setdefault(name.lower(), []).append((name, value))
+
+    def set(self, name: str, value):
+        """add a header, replacing all previous headers of the same name"""
+        self._headers[name.lower()] = [(name, value)]
+
+    def get(self, name: str, default=None):
+        """the value of the first header called name"""
+        values = self._headers.get(name.lower())
+        return values[0][1] if values else default
+
+    def get_all(self, name: str) -> list[tuple[str, object]]:
+        """all (name, value) tuples of the headers called name"""
+        return list(self._headers.get(name.lower(), ()))
+
+    def pop(self, name: str):
+        """remove all headers called name"""
+        self._headers.pop(name.lower(), None)
+
+    def clear(self):
+        self._headers.clear()
+
+    def serialize(self) -> bytes:
+        """the header lines, each ended by CRLF, without the empty line ending the header block"""
+        return ''.join(f"{name}: {value}\r\n" for name, value in self).encode('latin-1', 'strict')
+
+
+def build_response(status_line: bytes, headers: HeaderMap, body: bytes = b'') -> bytes:
+    """
+    Serialize a response head and a body into one buffer, to be sent with a single write.
+
+    Args:
+        status_line (bytes): e.g. b'HTTP/1.1 200 OK\\r\\n'.
+        headers (HeaderMap): the response headers.
+        body (bytes): the body, if it should be sent in the same write.
+    """
+    return b''.join((status_line, headers.serialize(), b'\r\n', body))
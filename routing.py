@@ -0,0 +1,162 @@
+from typing import Callable, NamedTuple
+
+
+class Match(NamedTuple):
+    """
+    Result of Router.match.
+
+    handler is None if no route matched, allowed then holds the methods
+    registered for the path (empty if the path is unknown, i.e. 404).
+    """
+    handler: Callable = None
+    params: dict = {}
+    allowed: frozenset = frozenset()
+
+
+class _Node:
+    __slots__ = ('literals', 'param', 'rest', 'handlers')
+
+    def __init__(self):
+        self.literals = {}
+        self.param = None
+        self.rest = None
+        self.handlers = {}
+
+
+class Router:
+    """
+    Table of the handlers for request methods and path patterns.
+
+    Patterns consist of segments separated by '/':
+        - literal segments match case-insensitive, e.g. '/fileserver/upload'
+        - '<name>' matches any single segment, passed to the handler as keyword name
+        - '<path:name>' matches all remaining segments (also none), passed as a list
+
+    Routes are compiled into a trie of path segments, literal segments take precedence
+    over parameters. Handlers are called with the request handler (SimpleServer) as
+    first argument and the path parameters as keyword arguments.
+
+    Example:
+        router = Router()
+
+        @router.get('/user/<name>')
+        def user(server, name):
+            server.return_string(name)
+    """
+    def __init__(self):
+        self.routes = []
+        self._root = _Node()
+
+    def add(self, pattern: str, handler: Callable, methods=('GET',)):
+        """
+        Register handler for the given methods and path pattern.
+
+        Raises:
+            ValueError: if the pattern is malformed or a method is already registered for it.
+        """
+        node = self._root
+        segments = [segment for segment in pattern.split('/') if segment]
+        for index, segment in enumerate(segments):
+            if segment.startswith('<') and segment.endswith('>'):
+                kind, _, name = segment[1:-1].rpartition(':')
+                if not name.isidentifier() or kind not in ('', 'path'):
+                    raise ValueError(f"invalid parameter {segment} in route {pattern}")
+                if kind == 'path':
+                    if index != len(segments) - 1:
+                        raise ValueError(f"{segment} must be the last segment of route {pattern}")
+                    if node.rest is None:
+                        node.rest = (name, _Node())
+                    elif node.rest[0] != name:
+                        raise ValueError(f"route {pattern} conflicts with parameter {node.rest[0]}")
+                    node = node.rest[1]
+                else:
+                    if node.param is None:
+                        node.param = (name, _Node())
+                    elif node.param[0] != name:
+                        raise ValueError(f"route {pattern} conflicts with parameter {node.param[0]}")
+                    node = node.param[1]
+            else:
+                node = node.literals.setdefault(segment.lower(), _Node())
+        for method in methods:
+            method = method.upper()
+            if method in node.handlers:
+                raise ValueError(f"{method} {pattern} is already routed to {node.handlers[method]}")
+            node.handlers[method] = handler
+        self.routes.append((pattern, handler, tuple(methods)))
+
+    def route(self, *patterns: str, methods=('GET',)):
+        """decorator registering the function for all patterns and methods"""
+        def decorator(handler):
+            for pattern in patterns:
+                self.add(pattern, handler, methods)
+            return handler
+        return decorator
+
+    def get(self, *patterns: str):
+        return self.route(*patterns, methods=('GET',))
+
+    def post(self, *patterns: str):
+        return self.route(*patterns, methods=('POST',))
+
+    def put(self, *patterns: str):
+        return self.route(*patterns, methods=('PUT',))
+
+    def include(self, other: 'Router'):
+        """register all routes of other in this router"""
+        for pattern, handler, methods in other.routes:
+            self.add(pattern, handler, methods)
+
+    def _find(self, node: _Node, segments: list[str], index: int, params: dict):
+        while index < len(segments):
+            child = node.literals.get(segments[index].lower())
+            if child is None:
+                break
+            if node.param is None and node.rest is None:
+                node = child
+                index += 1
+                continue
+            # literal first, fall back to the parameters of this node if the literal branch fails
+            found = self._find(child, segments, index + 1, params)
+            if found is not None:
+                return found
+            break
+        else:
+            if node.handlers:
+                return node
+            if node.rest is not None and node.rest[1].handlers:
+                params[node.rest[0]] = []
+                return node.rest[1]
+            return None
+        if node.param is not None:
+            found = self._find(node.param[1], segments, index + 1, params)
+            if found is not None:
+                params[node.param[0]] = segments[index]
+                return found
+        if node.rest is not None and node.rest[1].handlers:
+            params[node.rest[0]] = segments[index:]
+            return node.rest[1]
+        return None
+
+    def match(self, method: str, segments: list[str]) -> Match:
+        """
+        Find the handler for a request, HEAD requests get the GET handler unless one is registered for HEAD.
+
+        Args:
+            method (str): the request method, e.g. 'GET'.
+            segments (list[str]): the unquoted path segments, see RequestParameters.splitpath.
+        """
+        params = {}
+        node = self._find(self._root, segments, 0, params)
+        if node is None:
+            return Match()
+        method = method.upper()
+        # HEAD is allowed wherever GET is, it is answered by the GET handler
+        allowed = frozenset(node.handlers)
+        if 'GET' in allowed:
+            allowed |= {'HEAD'}
+        handler = node.handlers.get(method)
+        if handler is None and method == 'HEAD':
+            handler = node.handlers.get('GET')
+        if handler is None:
+            return Match(allowed=allowed)
+        return Match(handler, params, allowed)
@@ -0,0 +1,162 @@
+"""
+Content-addressed storage for uploaded files.
+
+Every distinct content is stored once as an object named by its SHA-256 digest,
+e.g. fileroot/.objects/3a/3a7bd3e2360a3d29eea436fcfb7e44c735d117c42d1c1835420b6b9942dd4f1b.
+The files in userfiles keep their per-upload names and are hardlinks to their object,
+so uploading the same content again only adds a directory entry.
+
+Run this module to adopt files that are not linked yet (e.g. uploads from before
+the object store existed) and to deduplicate them:
+
+usage: python storage.py [-h] [--prune] [directory ...]
+"""
+import hashlib
+import os
+import uuid
+
+from general import Settings
+
+CHUNK_SIZE = 2 ** 16
+
+
+def hash_file(path: str) -> str:
+    """the SHA-256 hex digest of the file at path"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as byte_file:
+        while chunk := byte_file.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ObjectStore:
+    """
+    Directory of files named by the SHA-256 digest of their content.
+
+    Must be on the same file system as the files linked to it. If the file system
+    does not support hardlinks, files are kept as they are and not deduplicated.
+
+    Args:
+        root (str): the object directory, created on first use.
+    """
+    def __init__(self, root: str):
+        self.root = root
+
+    def object_path(self, digest: str) -> str:
+        if len(digest) != 64 or not all(c in '0123456789abcdef' for c in digest):
+            raise ValueError("not a SHA-256 hex digest: " + digest)
+        return os.path.join(self.root, digest[:2], digest)
+
+    def __contains__(self, digest: str) -> bool:
+        return os.path.isfile(self.object_path(digest))
+
+    def adopt(self, path: str, digest: str = None) -> bool:
+        """
+        Deduplicate the file at path.
+
+        If its content is not stored yet, the file becomes the object, otherwise it is
+        atomically replaced by a hardlink to the existing object.
+
+        Args:
+            path (str): a regular file that is not modified anymore.
+            digest (str): the SHA-256 hex digest of the file, computed if not given.
+
+        Returns:
+            True if the file is linked to the object store, False if the file system
+            does not support it.
+        """
+        if digest is None:
+            digest = hash_file(path)
+        target = self.object_path(digest)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        for _ in range(3):
+            try:
+                os.link(path, target)
+                return True
+            except FileExistsError:
+                pass
+            except OSError:
+                return False
+            if os.path.samefile(path, target):
+                return True
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                os.link(target, tmp)
+            except FileNotFoundError:
+                continue  # pruned in the meantime, try to become the object
+            except OSError:
+                return False
+            os.replace(tmp, path)
+            return True
+        return False
+
+    def prune(self) -> int:
+        """
+        Remove objects no file links to anymore.
+
+        Returns:
+            The number of removed objects.
+        """
+        removed = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                if os.stat(path).st_nlink == 1:
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+    def rebuild(self, directory: str) -> dict:
+        """
+        Adopt all files below directory, see adopt. Hidden and temporary files are skipped.
+
+        Returns:
+            A dict with the number of 'files', newly 'stored' objects and 'linked' duplicates.
+        """
+        stats = {'files': 0, 'stored': 0, 'linked': 0}
+        for root, dirs, names in os.walk(directory):
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            for name in names:
+                path = os.path.join(root, name)
+                if name.startswith('.') or name.endswith('.tmp') or not os.path.isfile(path):
+                    continue
+                stats['files'] += 1
+                digest = hash_file(path)
+                known = digest in self
+                if known and os.path.samefile(path, self.object_path(digest)):
+                    continue
+                if self.adopt(path, digest):
+                    stats['linked' if known else 'stored'] += 1
+        return stats
+
+
+def object_store(settings: Settings) -> ObjectStore:
+    """
+    the ObjectStore of 'object store', by default fileroot/.objects: on the file system of
+    the uploads, as needed for hardlinks, and not served by /files like any hidden path
+    """
+    if 'object store' in settings:
+        return ObjectStore(settings.get_path('object store'))
+    return ObjectStore(settings.get_path('fileroot', '.objects'))
+
+
+def main(argv=None):
+    # only needed on the command line, not in the workers importing this module through addons
+    import argparse
+    settings = Settings('settings.txt')
+    parser = argparse.ArgumentParser(description="link uploaded files into the content-addressed object store")
+    parser.add_argument('directories', nargs='*', help="directories to adopt, defaults to fileroot/userfiles")
+    parser.add_argument('--prune', action='store_true', help="remove objects no file links to")
+    args = parser.parse_args(argv)
+
+    store = object_store(settings)
+    directories = args.directories or [settings.get_path('fileroot', 'userfiles')]
+    for directory in directories:
+        if os.path.isdir(directory):
+            print(directory, store.rebuild(directory))
+    if args.prune:
+        print('pruned', store.prune())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,582 @@
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+from time import monotonic, sleep, time
+
+
+# sent to the supervisor to start a new generation of workers
+RELOAD_SIGNAL = getattr(signal, 'SIGHUP', None)
+# sent by the supervisor to workers that should finish their requests and exit
+DRAIN_SIGNAL = getattr(signal, 'SIGUSR1', None)
+# sent to the supervisor to print its counters
+STATS_SIGNAL = getattr(signal, 'SIGUSR2', None)
+# User-Agent of the liveness probe, so servers can keep it out of their access logs
+PROBE_AGENT = 'supervisor-probe'
+# workers are forked so they inherit the listening sockets and the imported modules, forkserver is
+# the default start method on Linux since Python 3.14; platforms without fork use their default
+_context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+
+_drain_callbacks = []
+# TLS client context of probe_status and the last session per (host, port), so probes resume their sessions
+_probe_context = None
+_probe_sessions = {}
+_supervisor_pid = None
+_heartbeat = None
+_progress = None
+
+
+def heartbeat():
+    """tell the supervisor that this worker is alive, see start_heartbeat"""
+    if _heartbeat is not None:
+        _heartbeat.value = monotonic()
+
+
+def start_heartbeat(healthy=None, interval: float = 1.0, progress=None) -> threading.Thread:
+    """
+    Send heartbeats from a background thread every interval seconds while healthy() is True.
+
+    The thread does not depend on the serving loop, which legitimately blocks while all
+    handler threads are busy or a long request is served in 'single' mode. healthy should
+    check real progress instead, e.g. that no request went without I/O for a request timeout.
+    A worker that stops beating is replaced, see Supervisor.heartbeat_timeout.
+
+    progress() returns the monotonic time the worker last made progress (e.g. the latest I/O
+    of its requests, or now if it is idle). It is reported to the supervisor along with the
+    heartbeat, which restarts a listener that is busy without any of its workers making
+    progress, see Supervisor.probe_listeners. Without progress the worker counts as progressing.
+
+    Returns:
+        The started thread, None if this process is not a supervised worker.
+    """
+    if _heartbeat is None:
+        return None
+
+    def run():
+        while True:
+            if healthy is None or healthy():
+                heartbeat()
+            if _progress is not None:
+                _progress.value = monotonic() if progress is None else progress()
+            sleep(interval)
+    thread = threading.Thread(target=run, name="heartbeat", daemon=True)
+    thread.start()
+    return thread
+
+
+def on_drain(callback):
+    """
+    Register callback to be run in this worker when the supervisor asks it to drain.
+
+    The callback must make the server stop accepting connections and return quickly,
+    the worker should exit once its in-flight requests are finished. Workers without
+    a callback exit immediately.
+    """
+    _drain_callbacks.append(callback)
+
+
+def request_reload() -> bool:
+    """
+    Ask the supervisor of this worker for a graceful reload, see Supervisor.reload.
+
+    Returns:
+        False if this process is not a supervised worker.
+    """
+    if _supervisor_pid is None or RELOAD_SIGNAL is None:
+        return False
+    os.kill(_supervisor_pid, RELOAD_SIGNAL)
+    return True
+
+
+def _drain(signum, frame):
+    if not _drain_callbacks:
+        sys.exit(0)
+    for callback in _drain_callbacks:
+        callback()
+
+
+PROBE_OK = 'ok'
+PROBE_BUSY = 'busy'
+PROBE_DOWN = 'down'
+
+
+def probe(host: str, port: int, use_ssl: bool = False, timeout: float = 1.0) -> bool:
+    """
+    Check that a server accepts, reads and answers a request on host:port.
+
+    Returns:
+        True if the server answered, see probe_status.
+    """
+    return probe_status(host, port, use_ssl, timeout) == PROBE_OK
+
+
+def probe_status(host: str, port: int, use_ssl: bool = False, timeout: float = 1.0) -> str:
+    """
+    Send a HEAD request to host:port and expect the start of an HTTP response, any status counts.
+
+    Certificates are not verified, the probe only connects to the local listener. TLS probes
+    resume the session of the previous probe, so they do not cost a full handshake each.
+
+    Returns:
+        PROBE_OK if the server answered, PROBE_BUSY if the connection was accepted but the
+        answer did not arrive within timeout seconds (e.g. all handler threads are busy),
+        PROBE_DOWN if the connection was refused or closed without an HTTP response.
+    """
+    if host in ('', '0.0.0.0'):
+        host = '127.0.0.1'
+    elif host == '::':
+        host = '::1'
+    global _probe_context
+    request = f"HEAD / HTTP/1.0\r\nHost: {host}\r\nUser-Agent: {PROBE_AGENT}\r\n\r\n".encode()
+    try:
+        sock = socket.create_connection((host, port), timeout=timeout)
+    except socket.timeout:
+        # the listen backlog is full
+        return PROBE_BUSY
+    except OSError:
+        return PROBE_DOWN
+    try:
+        with sock:
+            if use_ssl:
+                if _probe_context is None:
+                    import ssl
+                    _probe_context = ssl.create_default_context()
+                    _probe_context.check_hostname = False
+                    _probe_context.verify_mode = ssl.CERT_NONE
+                sock = _probe_context.wrap_socket(sock, session=_probe_sessions.get((host, port)))
+            with sock:
+                sock.sendall(request)
+                response = b''
+                while len(response) < 5:
+                    data = sock.recv(5 - len(response))
+                    if not data:
+                        break
+                    response += data
+                if use_ssl and sock.session is not None:
+                    _probe_sessions[(host, port)] = sock.session
+                return PROBE_OK if response == b'HTTP/' else PROBE_DOWN
+    except socket.timeout:
+        return PROBE_BUSY
+    except OSError:
+        return PROBE_DOWN
+
+
+def _run_worker(target, args: tuple, kwargs: dict, heartbeat_value=None, progress_value=None):
+    """
+    Entry point of a worker process.
+
+    Ctrl-C and SIGHUP are left to the supervisor, SIGTERM ends the worker by raising
+    SystemExit so the server can close its sockets on the way out, DRAIN_SIGNAL runs
+    the callbacks registered with on_drain.
+    """
+    global _supervisor_pid, _heartbeat, _progress
+    _supervisor_pid = os.getppid()
+    _heartbeat = heartbeat_value
+    _progress = progress_value
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    for signum in (RELOAD_SIGNAL, STATS_SIGNAL):
+        if signum is not None:
+            signal.signal(signum, signal.SIG_IGN)
+    if DRAIN_SIGNAL is not None:
+        signal.signal(DRAIN_SIGNAL, _drain)
+    target(*args, **kwargs)
+
+
+class WorkerProcess(_context.Process):
+    """
+    A worker process with the shared memory it reports its heartbeat and progress in.
+
+    Attributes:
+        slot (int): the position of the worker in its listener, see Listener.socket_for.
+        started (float): monotonic time the process was started.
+        heartbeat (multiprocessing.Value): monotonic time of the last heartbeat, 0 before the first.
+        progress (multiprocessing.Value): monotonic time the worker last made progress, 0 if it
+            does not report progress, see start_heartbeat.
+    """
+    def __init__(self, target, args: tuple, kwargs: dict, name: str, slot: int = 0):
+        self.heartbeat = _context.Value('d', 0.0, lock=False)
+        self.progress = _context.Value('d', 0.0, lock=False)
+        self.slot = slot
+        self.started = monotonic()
+        super().__init__(target=_run_worker, args=(target, args, kwargs, self.heartbeat, self.progress),
+                         name=name)
+
+    def last_sign_of_life(self) -> float:
+        return max(self.started, self.heartbeat.value)
+
+
+class Listener:
+    """
+    One listening address served by a group of identical worker processes.
+
+    Args:
+        server: the request handler class passed on to the worker target.
+        use_ssl (bool): whether the workers wrap the socket with TLS.
+        port (int): the port to listen on.
+        host (str): the host to listen on.
+        workers (int): number of worker processes, 0 or less means one per CPU.
+        reuse_port (bool): bind one socket with SO_REUSEPORT per worker, so the kernel
+            balances connections between them, instead of one socket shared by all workers.
+        probe (bool): check the listener with a local HEAD request, see probe.
+        backlog (int): the listen backlog of the shared socket.
+    """
+    def __init__(self, server, use_ssl: bool, port: int, host: str, *, workers: int = 0, reuse_port: bool = False,
+                 probe: bool = True, backlog: int = 128):
+        self.server = server
+        self.use_ssl = use_ssl
+        self.port = int(port)
+        self.host = host
+        self.workers = int(workers) if int(workers) > 0 else (os.cpu_count() or 1)
+        self.reuse_port = bool(reuse_port) and hasattr(socket, 'SO_REUSEPORT')
+        self.probe = probe
+        self.backlog = backlog
+        self.sockets = []
+        self.processes = []
+        self.restarts = 0
+        self.crashes = 0
+        self.probe_failures = 0
+        self.busy_probes = 0
+        self.busy_in_row = 0
+        self.busy_since = 0.0
+        self.next_spawn = 0.0
+        self.next_probe = 0.0
+
+    def __str__(self):
+        return f"{self.server.__name__} on {self.host}:{self.port}"
+
+    def open(self):
+        """
+        Bind the listening sockets, which stay open until close.
+
+        The supervisor owns them and every worker inherits the socket of its slot, so the
+        replacement of a worker, e.g. on reload, serves the connections already waiting in
+        the backlog instead of them being reset when the old worker closes its socket.
+        """
+        if self.sockets:
+            return
+        for _ in range(self.workers if self.reuse_port else 1):
+            self.sockets.append(
+                socket.create_server((self.host, self.port), backlog=self.backlog, reuse_port=self.reuse_port))
+
+    def socket_for(self, slot: int) -> socket.socket:
+        """the listening socket of the worker in slot"""
+        return self.sockets[slot % len(self.sockets)]
+
+    def close(self):
+        for sock in self.sockets:
+            sock.close()
+        self.sockets = []
+
+
+class Supervisor:
+    """
+    Pre-fork supervisor that runs every listener in several worker processes.
+
+    All workers of a listener accept connections from the same port, either from one
+    socket or from one SO_REUSEPORT socket per worker, inherited from the supervisor.
+
+    Liveness is checked every poll_interval seconds: workers that exited are replaced,
+    workers that sent no heartbeat for heartbeat_timeout seconds (see start_heartbeat) are
+    killed and replaced, and every probe_interval seconds each listener is probed with a
+    local HEAD request (see probe_status). After probe_failures probes in a row found the
+    listener down, all its workers are restarted. Probes that connect but get no answer in
+    time count as busy: a listener is only restarted after probe_failures busy probes in a
+    row if none of its workers reported progress since the first of them, a listener that
+    is merely overloaded keeps its workers. Workers crashing
+    within stable_after seconds of their start are restarted with exponential backoff,
+    from restart_backoff up to max_backoff seconds. stats() (printed on SIGUSR2) reports restarts and uptimes.
+
+    SIGHUP (or request_reload from a worker) starts a graceful reload: on_reload refreshes
+    code and settings in the supervisor, a new generation of workers is forked from it and
+    the old workers drain. The listening sockets stay open all the time.
+
+    Args:
+        target: the function run in each worker, called as
+            target(server, use_ssl, port, host, sock=..., reuse_port=...).
+        poll_interval (float): seconds between checks for dead workers.
+        heartbeat_timeout (float): seconds without heartbeat after which a worker counts as hung,
+            0 disables the check.
+        probe_interval (float): seconds between two probes of a listener, 0 disables probing.
+        probe_timeout (float): seconds a probe may take.
+        probe_failures (int): failed probes in a row that restart a listener.
+        startup_grace (float): seconds after starting its workers before a listener is probed.
+        restart_backoff (float): delay before restarting a worker that crashed right after its start.
+        max_backoff (float): the maximum restart delay.
+        stable_after (float): seconds a worker must run to reset the backoff.
+        drain_timeout (float): seconds old workers get to finish their requests after a reload.
+        on_reload: called without arguments before the new workers are started,
+            if it raises the reload is cancelled and the current workers keep running.
+    """
+    def __init__(self, target, *, poll_interval: float = 0.25, heartbeat_timeout: float = 30,
+                 probe_interval: float = 1.0, probe_timeout: float = 1.0, probe_failures: int = 3,
+                 startup_grace: float = 2, restart_backoff: float = 0.5, max_backoff: float = 30,
+                 stable_after: float = 10, drain_timeout: float = 30, on_reload=None):
+        self.target = target
+        self.poll_interval = poll_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.probe_failures = probe_failures
+        self.startup_grace = startup_grace
+        self.restart_backoff = restart_backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.drain_timeout = drain_timeout
+        self.on_reload = on_reload
+        self.listeners = []
+        self.generation = 0
+        self.draining = []
+        self.restarts = 0
+        self.started = None
+        self._running = False
+        self._reload_requested = False
+        self._stats_requested = False
+
+    def add_listener(self, server, use_ssl: bool, port: int, host: str, **kwargs) -> Listener:
+        """create a Listener (see there for the arguments) and add it to the supervisor"""
+        listener = Listener(server, use_ssl, port, host, **kwargs)
+        self.listeners.append(listener)
+        return listener
+
+    def _spawn(self, listener: Listener, slot: int) -> WorkerProcess:
+        process = WorkerProcess(
+            self.target,
+            (listener.server, listener.use_ssl, listener.port, listener.host),
+            {'sock': listener.socket_for(slot), 'reuse_port': listener.reuse_port},
+            name=f"worker {listener}",
+            slot=slot
+            )
+        process.start()
+        return process
+
+    def _spawn_all(self, listener: Listener) -> list[WorkerProcess]:
+        listener.next_probe = monotonic() + self.startup_grace
+        listener.probe_failures = 0
+        return [self._spawn(listener, slot) for slot in range(listener.workers)]
+
+    def start(self):
+        """bind all listeners and start their workers"""
+        for listener in self.listeners:
+            listener.open()
+        for listener in self.listeners:
+            listener.processes = self._spawn_all(listener)
+        self.started = monotonic()
+        self._running = True
+
+    def _hung(self, process: WorkerProcess, now: float) -> bool:
+        return bool(self.heartbeat_timeout) and now - process.last_sign_of_life() > self.heartbeat_timeout
+
+    def replace_dead_workers(self):
+        """
+        Replace every worker that exited or stopped sending heartbeats.
+
+        A worker that crashed within stable_after seconds of its start delays the next
+        restart of its listener, doubling the delay for every further early crash.
+        """
+        now = monotonic()
+        for listener in self.listeners:
+            alive = []
+            for process in listener.processes:
+                if process.is_alive() and not self._hung(process, now):
+                    alive.append(process)
+                    continue
+                if process.is_alive():
+                    print(f"worker {process.pid} of {listener} sent no heartbeat for {self.heartbeat_timeout}s, killing it")
+                    self._stop_processes([process], 1)
+                process.join()
+                if now - process.started < self.stable_after:
+                    listener.crashes += 1
+                    listener.next_spawn = now + min(self.max_backoff, self.restart_backoff * 2 ** (listener.crashes - 1))
+                else:
+                    listener.crashes = 0
+                print(f"worker {process.pid} of {listener} exited with {process.exitcode}, "
+                      f"restarting in {max(0.0, listener.next_spawn - now):.1f}s")
+            missing = sorted(set(range(listener.workers)) - {process.slot for process in alive})
+            if missing and now >= listener.next_spawn:
+                alive.extend(self._spawn(listener, slot) for slot in missing)
+                listener.restarts += len(missing)
+                self.restarts += len(missing)
+            listener.processes = alive
+
+    def restart_listener(self, listener: Listener, timeout: float = 5):
+        """stop all workers of the listener and start new ones, the socket stays open"""
+        self._stop_processes(listener.processes, timeout)
+        listener.processes = self._spawn_all(listener)
+        listener.restarts += listener.workers
+        self.restarts += listener.workers
+
+    def _stalled(self, listener: Listener) -> bool:
+        """True if no worker of the listener reported progress since its busy probes without progress began"""
+        return all(0 < process.progress.value < listener.busy_since for process in listener.processes)
+
+    def probe_listeners(self):
+        """
+        Probe every listener that is due and restart it after probe_failures probes in a row
+        found it down, or found it busy while none of its workers made progress.
+        """
+        now = monotonic()
+        for listener in self.listeners:
+            if not listener.probe or not self.probe_interval or now < listener.next_probe:
+                continue
+            listener.next_probe = now + self.probe_interval
+            status = probe_status(listener.host, listener.port, listener.use_ssl, self.probe_timeout)
+            if status == PROBE_BUSY:
+                listener.busy_probes += 1
+                if not listener.busy_in_row or not self._stalled(listener):
+                    # a worker made progress, only busy probes without progress count
+                    listener.busy_in_row, listener.busy_since = 0, now
+                listener.busy_in_row += 1
+                if listener.busy_in_row < self.probe_failures:
+                    continue
+                print(f"{listener} was busy for {listener.busy_in_row} probes without progress, restarting its workers")
+                listener.busy_in_row = 0
+                self.restart_listener(listener)
+                listener.crashes += 1
+                listener.next_probe += min(self.max_backoff, self.restart_backoff * 2 ** (listener.crashes - 1))
+                continue
+            listener.busy_in_row = 0
+            if status == PROBE_OK:
+                listener.probe_failures = 0
+                if all(now - process.started >= self.stable_after for process in listener.processes):
+                    listener.crashes = 0
+                continue
+            listener.probe_failures += 1
+            if listener.probe_failures >= self.probe_failures:
+                print(f"{listener} failed {listener.probe_failures} probes in a row, restarting its workers")
+                self.restart_listener(listener)
+                listener.crashes += 1
+                listener.next_probe += min(self.max_backoff, self.restart_backoff * 2 ** (listener.crashes - 1))
+
+    def reload(self) -> bool:
+        """
+        Replace all workers by a new generation without closing the listening sockets.
+
+        The new workers are started first, then the old ones are sent DRAIN_SIGNAL:
+        they stop accepting, finish their in-flight requests and exit. Workers still
+        running after drain_timeout seconds are killed, see reap_drained.
+
+        Returns:
+            False if on_reload failed and the current workers were kept.
+        """
+        if self.on_reload is not None:
+            try:
+                self.on_reload()
+            except Exception as e:
+                print("reload failed, keeping the current workers:", repr(e))
+                return False
+        self.generation += 1
+        deadline = monotonic() + self.drain_timeout
+        for listener in self.listeners:
+            old = listener.processes
+            listener.processes = self._spawn_all(listener)
+            for process in old:
+                try:
+                    os.kill(process.pid, DRAIN_SIGNAL if DRAIN_SIGNAL is not None else signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+                self.draining.append((process, deadline))
+        print(f"started worker generation {self.generation}, {len(self.draining)} old workers draining")
+        return True
+
+    def reap_drained(self):
+        """join the old workers that finished draining, kill those exceeding the drain timeout"""
+        now = monotonic()
+        remaining = []
+        for process, deadline in self.draining:
+            if process.is_alive() and now < deadline:
+                remaining.append((process, deadline))
+                continue
+            if process.is_alive():
+                print(f"worker {process.pid} did not drain within {self.drain_timeout}s, killing it")
+                self._stop_processes([process], 1)
+            process.join()
+        self.draining = remaining
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            A dict with the 'uptime' of the supervisor in seconds, the worker 'generation',
+            the total number of 'restarts' and for every listener its alive 'workers',
+            'restarts', early 'crashes' in a row, 'probe failures' in a row, 'busy probes' and the
+            'uptime' of its longest running worker.
+        """
+        now = monotonic()
+        return {
+            'uptime': round(now - self.started, 3) if self.started is not None else 0,
+            'generation': self.generation,
+            'restarts': self.restarts,
+            'listeners': {
+                str(listener): {
+                    'workers': sum(process.is_alive() for process in listener.processes),
+                    'restarts': listener.restarts,
+                    'crashes': listener.crashes,
+                    'probe failures': listener.probe_failures,
+                    'busy probes': listener.busy_probes,
+                    'uptime': round(max((now - process.started for process in listener.processes), default=0), 3),
+                }
+                for listener in self.listeners
+            },
+        }
+
+    @staticmethod
+    def _stop_processes(processes, timeout: float):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = monotonic() + timeout
+        for process in processes:
+            process.join(max(0, deadline - monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    def stop(self, timeout: float = 5):
+        """terminate all workers, kill those still running after timeout seconds and close the sockets"""
+        self._running = False
+        self._stop_processes([process for process, _ in self.draining], timeout)
+        self.draining = []
+        for listener in self.listeners:
+            self._stop_processes(listener.processes, timeout)
+            listener.processes = []
+            listener.close()
+
+    def _handle_signal(self, signum, frame):
+        self._running = False
+
+    def _handle_reload_signal(self, signum, frame):
+        # only flag it, the reload forks and must not run inside a signal handler
+        self._reload_requested = True
+
+    def _handle_stats_signal(self, signum, frame):
+        self._stats_requested = True
+
+    def run(self):
+        """
+        Start the workers and supervise them until SIGTERM or SIGINT,
+        SIGHUP reloads them gracefully, SIGUSR2 prints stats().
+        """
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        if RELOAD_SIGNAL is not None:
+            signal.signal(RELOAD_SIGNAL, self._handle_reload_signal)
+        if STATS_SIGNAL is not None:
+            signal.signal(STATS_SIGNAL, self._handle_stats_signal)
+        self.start()
+        try:
+            while self._running:
+                sleep(self.poll_interval)
+                if self._reload_requested:
+                    self._reload_requested = False
+                    self.reload()
+                self.reap_drained()
+                self.replace_dead_workers()
+                self.probe_listeners()
+                if self._stats_requested:
+                    self._stats_requested = False
+                    print(json.dumps({'time': time(), **self.stats()}), flush=True)
+        finally:
+            self.stop()
@@ -0,0 +1,264 @@
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+
+from RequestParameters import BodyReader, BodyTooLarge, MalformedBody, MultipartError, MultipartReader
+
+
+def chunked(*chunks: bytes, trailers: bytes = b'') -> bytes:
+    """encode chunks with chunked transfer encoding"""
+    body = b''.join(b'%x\r\n%s\r\n' % (len(chunk), chunk) for chunk in chunks)
+    return body + b'0\r\n' + trailers + b'\r\n'
+
+
+def connection(data: bytes) -> io.BufferedReader:
+    return io.BufferedReader(io.BytesIO(data))
+
+
+class TrickleStream:
+    """returns at most step bytes per read, like a slow client"""
+    def __init__(self, data: bytes, step: int):
+        self.data = data
+        self.step = step
+
+    def read(self, size: int = -1) -> bytes:
+        size = self.step if size < 0 else min(size, self.step)
+        data, self.data = self.data[:size], self.data[size:]
+        return data
+
+
+class TestBodyReaderLength(unittest.TestCase):
+    def test_reads_only_the_body(self):
+        rfile = connection(b'hello worldGET / HTTP/1.1\r\n')
+        body = BodyReader(rfile, 11)
+        self.assertEqual(body.read(5), b'hello')
+        self.assertEqual(body.read(), b' world')
+        self.assertTrue(body.done)
+        self.assertEqual(body.read(), b'')
+        self.assertEqual(rfile.read(), b'GET / HTTP/1.1\r\n')
+
+    def test_announced_length_over_limit(self):
+        with self.assertRaises(BodyTooLarge):
+            BodyReader(connection(b'x' * 11), 11, limit=10)
+
+    def test_truncated_body_ends(self):
+        body = BodyReader(connection(b'abc'), 10)
+        self.assertEqual(body.read(), b'abc')
+        self.assertEqual(body.read(), b'')
+        self.assertTrue(body.done)
+
+    def test_on_data(self):
+        calls = []
+        body = BodyReader(connection(b'abcdef'), 6, on_data=lambda: calls.append(1))
+        list(body.iter_chunks(2))
+        self.assertEqual(len(calls), 3)
+
+
+class TestBodyReaderChunked(unittest.TestCase):
+    def test_decodes_chunks(self):
+        rfile = connection(chunked(b'hello ', b'chunked', b' world') + b'NEXT')
+        body = BodyReader(rfile, chunked=True)
+        self.assertEqual(body.read(), b'hello chunked world')
+        self.assertTrue(body.done)
+        self.assertEqual(body.received, 19)
+        self.assertEqual(rfile.read(), b'NEXT')
+
+    def test_reads_across_chunk_boundaries(self):
+        body = BodyReader(connection(chunked(b'abc', b'defg', b'h')), chunked=True)
+        pieces = list(body.iter_chunks(2))
+        self.assertEqual(b''.join(pieces), b'abcdefgh')
+        self.assertTrue(all(len(piece) <= 2 for piece in pieces))
+
+    def test_readline(self):
+        body = BodyReader(connection(chunked(b'one\ntw', b'o\nthree')), chunked=True)
+        self.assertEqual(body.readline(), b'one\n')
+        self.assertEqual(body.readline(), b'tw')
+        self.assertEqual(body.readline(), b'o\n')
+        self.assertEqual(body.readline(), b'three')
+        self.assertEqual(body.readline(), b'')
+
+    def test_extensions_and_trailers_are_ignored(self):
+        data = b'5;name=value\r\nhello\r\n0;last\r\nExpires: never\r\nX-Sum: 1\r\n\r\nNEXT'
+        rfile = connection(data)
+        body = BodyReader(rfile, chunked=True)
+        self.assertEqual(body.read(), b'hello')
+        self.assertTrue(body.done)
+        self.assertEqual(rfile.read(), b'NEXT')
+
+    def test_bare_line_feeds(self):
+        body = BodyReader(connection(b'3\nabc\n0\n\n'), chunked=True)
+        self.assertEqual(body.read(), b'abc')
+        self.assertTrue(body.done)
+
+    def test_limit_overrun(self):
+        body = BodyReader(connection(chunked(b'x' * 6, b'y' * 6)), chunked=True, limit=10)
+        self.assertEqual(body.read(6), b'x' * 6)
+        with self.assertRaises(BodyTooLarge):
+            body.read()
+
+    def test_malformed_framing(self):
+        cases = {
+            'size not hex': b'zz\r\nabc\r\n0\r\n\r\n',
+            'negative size': b'-3\r\nabc\r\n0\r\n\r\n',
+            'size line without end': b'3',
+            'data not terminated': b'3\r\nabcX\r\n0\r\n\r\n',
+            'truncated data': b'10\r\nabc',
+            'endless trailers': b'0\r\n' + b'X-A: 1\r\n' * 101,
+        }
+        for name, data in cases.items():
+            with self.subTest(name):
+                with self.assertRaises(MalformedBody):
+                    BodyReader(connection(data), chunked=True).read()
+
+    def test_size_line_too_long(self):
+        data = b'0' * (BodyReader.max_line + 1) + b'3\r\nabc\r\n0\r\n\r\n'
+        with self.assertRaises(MalformedBody):
+            BodyReader(connection(data), chunked=True).read()
+
+    def test_discard(self):
+        rfile = connection(chunked(b'a' * 100, b'b' * 100) + b'NEXT')
+        body = BodyReader(rfile, chunked=True)
+        body.read(10)
+        self.assertTrue(body.discard())
+        self.assertEqual(rfile.read(), b'NEXT')
+
+    def test_discard_over_limit(self):
+        body = BodyReader(connection(chunked(b'a' * 100)), chunked=True)
+        self.assertFalse(body.discard(limit=50))
+        body = BodyReader(connection(b'a' * 100), 100)
+        self.assertFalse(body.discard(limit=50))
+
+    def test_discard_malformed(self):
+        body = BodyReader(connection(b'3\r\nabcX'), chunked=True)
+        self.assertFalse(body.discard())
+
+
+class TestMultipartReader(unittest.TestCase):
+    boundary = 'xYzZY'
+    # the content may contain prefixes of the delimiter, but not the delimiter itself
+    content = b'line one\r\n--xYzZ not a delimiter\r\n\r\n-xYzZY neither\r\n' + bytes(range(256)) * 8
+
+    def setUp(self):
+        self.spool = tempfile.TemporaryDirectory()
+        self.addCleanup(self.spool.cleanup)
+
+    def body(self) -> bytes:
+        return (
+            b'preamble, ignored\r\n'
+            b'--xYzZY\r\n'
+            b'Content-Disposition: form-data; name="title"\r\n'
+            b'\r\n'
+            b'Gr\xc3\xbc\xc3\x9fe\r\n'
+            b'--xYzZY  \t\r\n'
+            b'Content-Disposition: form-data; name="upload"; filename="data.bin"\r\n'
+            b'Content-Type: application/x-test\r\n'
+            b'\r\n'
+            + self.content + b'\r\n'
+            b'--xYzZY\r\n'
+            b'Content-Disposition: form-data; name="empty"\r\n'
+            b'\r\n'
+            b'\r\n'
+            b'--xYzZY--\r\n'
+            b'epilogue, ignored'
+        )
+
+    def parse(self, data: bytes, step: int = None, **kwargs):
+        stream = io.BytesIO(data) if step is None else TrickleStream(data, step)
+        return MultipartReader(stream, self.boundary, spool_dir=self.spool.name, **kwargs).parse()
+
+    def spooled(self) -> list[str]:
+        return os.listdir(self.spool.name)
+
+    def test_fields_and_files(self):
+        form = self.parse(self.body())
+        self.assertEqual([part.name for part in form], ['title', 'upload', 'empty'])
+        self.assertEqual(form.get('title').value, 'Grüße')
+        self.assertFalse(form.get('title').is_file)
+        self.assertEqual(form.get('empty').raw, b'')
+        upload = form.get('upload')
+        self.assertTrue(upload.is_file)
+        self.assertEqual(upload.filename, 'data.bin')
+        self.assertEqual(upload.content_type, 'application/x-test')
+        self.assertEqual(upload.raw, self.content)
+        self.assertEqual(upload.size, len(self.content))
+        self.assertEqual(upload.sha256, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(os.path.dirname(upload.path), self.spool.name)
+        form.cleanup()
+        self.assertEqual(self.spooled(), [])
+
+    def test_delimiters_split_across_reads(self):
+        data = self.body()
+        for step in (1, 2, 3, 7, 8, 9, 64):
+            for chunk_size in (1, 5, 16, 2 ** 16):
+                with self.subTest(step=step, chunk_size=chunk_size):
+                    form = self.parse(data, step, chunk_size=chunk_size)
+                    self.assertEqual(form.get('title').value, 'Grüße')
+                    self.assertEqual(form.get('upload').raw, self.content)
+                    self.assertEqual(form.get('empty').raw, b'')
+                    form.cleanup()
+
+    def test_chunked_body(self):
+        data = self.body()
+        encoded = chunked(*(data[index:index + 13] for index in range(0, len(data), 13)))
+        body = BodyReader(connection(encoded), chunked=True)
+        form = MultipartReader(body, self.boundary, spool_dir=self.spool.name, chunk_size=10).parse()
+        self.assertEqual(form.get('upload').raw, self.content)
+        form.cleanup()
+
+    def test_save_as(self):
+        form = self.parse(self.body())
+        target = os.path.join(self.spool.name, 'saved.bin')
+        form.get('upload').save_as(target)
+        form.cleanup()
+        self.assertEqual(self.spooled(), ['saved.bin'])
+        with open(target, 'rb') as saved:
+            self.assertEqual(saved.read(), self.content)
+
+    def test_memory_limit(self):
+        with self.assertRaises(BodyTooLarge):
+            self.parse(self.body(), memory_limit=5)
+        self.assertEqual(self.spooled(), [])
+
+    def test_memory_limit_ignores_files(self):
+        self.parse(self.body(), memory_limit=len('Grüße'.encode())).cleanup()
+
+    def test_max_parts(self):
+        with self.assertRaises(BodyTooLarge):
+            self.parse(self.body(), max_parts=2)
+        self.assertEqual(self.spooled(), [])
+
+    def test_truncated_body(self):
+        data = self.body()
+        for end in (len(data) // 2, data.index(b'--xYzZY--')):
+            with self.subTest(end=end):
+                with self.assertRaises(MultipartError):
+                    self.parse(data[:end], 4)
+                self.assertEqual(self.spooled(), [])
+
+    def test_no_delimiter(self):
+        with self.assertRaises(MultipartError):
+            self.parse(b'no parts at all')
+
+    def test_garbage_after_delimiter(self):
+        with self.assertRaises(MultipartError):
+            self.parse(b'--xYzZY garbage\r\n\r\nvalue\r\n--xYzZY--\r\n')
+
+    def test_header_too_long(self):
+        data = (b'--xYzZY\r\nX-Long: ' + b'a' * MultipartReader.max_header_size
+                + b'\r\n\r\nvalue\r\n--xYzZY--\r\n')
+        for step in (None, 100):
+            with self.subTest(step=step):
+                with self.assertRaises(MultipartError):
+                    self.parse(data, step)
+
+    def test_invalid_boundary(self):
+        for boundary in ('', 'b' * 201):
+            with self.subTest(length=len(boundary)):
+                with self.assertRaises(MultipartError):
+                    MultipartReader(io.BytesIO(), boundary)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+from SimpleServer import parse_range_header
+
+
+class TestParseRangeHeader(unittest.TestCase):
+    def test_ranges(self):
+        cases = {
+            'bytes=0-499': [(0, 499)],
+            'bytes=500-': [(500, 999)],
+            'bytes=-200': [(800, 999)],
+            'bytes=-2000': [(0, 999)],
+            'bytes=900-5000': [(900, 999)],
+            'bytes=999-999': [(999, 999)],
+            'bytes=0-0, -1': [(0, 0), (999, 999)],
+            ' Bytes = 1-2 ,3-4 ': [(1, 2), (3, 4)],
+        }
+        for header, expected in cases.items():
+            with self.subTest(header):
+                self.assertEqual(parse_range_header(header, 1000), expected)
+
+    def test_unsatisfiable(self):
+        for header in ('bytes=1000-', 'bytes=1000-2000', 'bytes=-0', 'bytes=5000-, -0'):
+            with self.subTest(header):
+                self.assertEqual(parse_range_header(header, 1000), [])
+        self.assertEqual(parse_range_header('bytes=0-', 0), [])
+        self.assertEqual(parse_range_header('bytes=-5', 0), [])
+
+    def test_satisfiable_ranges_are_kept(self):
+        self.assertEqual(parse_range_header('bytes=5000-6000, 0-9', 1000), [(0, 9)])
+
+    def test_ignored(self):
+        for header in (
+                'items=0-1',
+                'bytes',
+                'bytes=',
+                'bytes=-',
+                'bytes=5',
+                'bytes=10-5',
+                'bytes=a-b',
+                'bytes=0-1,',
+                'bytes=-1-2',
+                'bytes=+1-2',
+                'bytes=١-٢',
+                ):
+            with self.subTest(header):
+                self.assertIsNone(parse_range_header(header, 1000))
+
+    def test_max_ranges(self):
+        header = 'bytes=' + ', '.join(f'{index}-{index}' for index in range(16))
+        self.assertEqual(len(parse_range_header(header, 1000)), 16)
+        self.assertIsNone(parse_range_header(header + ', 20-20', 1000))
+        self.assertIsNone(parse_range_header('bytes=0-1, 2-3', 1000, max_ranges=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+
+from routing import Router
+
+
+def handler(name: str):
+    def handle(server, **params):
+        return name, params
+    handle.__name__ = name
+    return handle
+
+
+class TestRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = Router()
+        for pattern in (
+                '/',
+                '/files/<path:path>',
+                '/files/archive/<year>/index',
+                '/user/<name>',
+                '/user/me',
+                '/user/me/settings',
+                '/user/<name>/posts/<post>',
+                '/a/b/c/d',
+                '/a/<x>/c/e',
+                '/a/<path:rest>',
+                ):
+            self.router.add(pattern, handler(pattern))
+        self.router.post('/user/<name>')(handler('post user'))
+
+    def route(self, path: str, method: str = 'GET'):
+        match = self.router.match(method, [segment for segment in path.split('/') if segment])
+        if match.handler is None:
+            return None
+        return match.handler(None, **match.params)
+
+    def test_literal_takes_precedence(self):
+        self.assertEqual(self.route('/user/me'), ('/user/me', {}))
+        self.assertEqual(self.route('/user/ME'), ('/user/me', {}))
+        self.assertEqual(self.route('/user/alice'), ('/user/<name>', {'name': 'alice'}))
+
+    def test_backtracks_from_literal_to_parameter(self):
+        self.assertEqual(self.route('/user/me/posts/1'), ('/user/<name>/posts/<post>', {'name': 'me', 'post': '1'}))
+
+    def test_backtracks_deep_into_the_trie(self):
+        self.assertEqual(self.route('/a/b/c/d'), ('/a/b/c/d', {}))
+        self.assertEqual(self.route('/a/b/c/e'), ('/a/<x>/c/e', {'x': 'b'}))
+        self.assertEqual(self.route('/a/b/c/f'), ('/a/<path:rest>', {'rest': ['b', 'c', 'f']}))
+        self.assertEqual(self.route('/a/b/c'), ('/a/<path:rest>', {'rest': ['b', 'c']}))
+
+    def test_backtracks_to_path_parameter(self):
+        self.assertEqual(self.route('/files/archive/2024/index'), ('/files/archive/<year>/index', {'year': '2024'}))
+        self.assertEqual(self.route('/files/archive/2024'), ('/files/<path:path>', {'path': ['archive', '2024']}))
+        self.assertEqual(self.route('/files/archive'), ('/files/<path:path>', {'path': ['archive']}))
+        self.assertEqual(self.route('/files'), ('/files/<path:path>', {'path': []}))
+
+    def test_failed_branches_leave_no_parameters(self):
+        self.assertEqual(self.route('/a/x/c/g'), ('/a/<path:rest>', {'rest': ['x', 'c', 'g']}))
+
+    def test_no_match(self):
+        self.assertIsNone(self.route('/unknown'))
+        self.assertIsNone(self.route('/user/me/settings/extra'))
+        self.assertEqual(self.router.match('GET', ['unknown']).allowed, frozenset())
+
+    def test_root(self):
+        self.assertEqual(self.route('/'), ('/', {}))
+
+    def test_methods(self):
+        self.assertEqual(self.route('/user/alice', 'POST'), ('post user', {'name': 'alice'}))
+        match = self.router.match('DELETE', ['user', 'alice'])
+        self.assertIsNone(match.handler)
+        self.assertEqual(match.allowed, {'GET', 'HEAD', 'POST'})
+        self.assertEqual(self.router.match('DELETE', ['user', 'me']).allowed, {'GET', 'HEAD'})
+
+    def test_head_uses_get(self):
+        self.assertEqual(self.route('/user/alice', 'HEAD'), ('/user/<name>', {'name': 'alice'}))
+        router = Router()
+        router.post('/form')(handler('form'))
+        match = router.match('HEAD', ['form'])
+        self.assertIsNone(match.handler)
+        self.assertEqual(match.allowed, {'POST'})
+
+    def test_invalid_routes(self):
+        for pattern in ('/user/<name>', '/x/<path:rest>/y', '/x/<other:name>', '/x/<not valid>', '/user/<other>'):
+            with self.subTest(pattern):
+                with self.assertRaises(ValueError):
+                    self.router.add(pattern, handler(pattern))
+
+    def test_include(self):
+        combined = Router()
+        combined.include(self.router)
+        self.assertEqual(combined.routes, self.router.routes)
+        self.assertEqual(combined.match('GET', ['a', 'b', 'c', 'e']).params, {'x': 'b'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+import http.server as http
+import queue
+import selectors
+import threading
+from time import monotonic
+
+
+class ThreadPoolHTTPServer(http.HTTPServer):
+    """
+    HTTPServer that serves connections from a fixed pool of worker threads.
+
+    Accepted connections are put into a bounded queue and picked up by the
+    next free worker. If the queue is full the accept loop blocks, so further
+    clients wait in the kernel listen backlog instead of piling up in memory.
+
+    Idle keep-alive connections do not hold a worker: handlers park them (see park)
+    and a selector thread queues them again once the next request arrives, or closes
+    them after the keep-alive timeout of their handler.
+
+    Args:
+        server_address: (host, port) tuple to bind to.
+        RequestHandlerClass: the handler class, e.g. SimpleServer or ForwardServer.
+        workers (int): number of worker threads.
+        queue_size (int): number of accepted connections that may wait for a worker,
+            also used as the listen backlog.
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, RequestHandlerClass, bind_and_activate: bool = True, *,
+                 workers: int = 16, queue_size: int = 64):
+        self.workers = max(1, int(workers))
+        self.request_queue_size = max(1, int(queue_size))
+        self._queue = queue.Queue(maxsize=self.request_queue_size)
+        self._busy = 0
+        self._busy_lock = threading.Lock()
+        self._threads = []
+        self._idle = selectors.DefaultSelector()
+        self._idle_lock = threading.Lock()
+        self._closing = False
+        self._local = threading.local()
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"http-worker-{i}", daemon=self.daemon_threads)
+            thread.start()
+            self._threads.append(thread)
+        self._idle_thread = threading.Thread(target=self._watch_idle, name="http-idle", daemon=True)
+        self._idle_thread.start()
+
+    @property
+    def busy_workers(self) -> int:
+        """number of workers currently handling a connection"""
+        return self._busy
+
+    @property
+    def idle_connections(self) -> int:
+        """number of parked keep-alive connections waiting for their next request"""
+        return len(self._idle.get_map() or ())
+
+    @property
+    def queue_depth(self) -> int:
+        """number of accepted connections waiting for a free worker"""
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        """
+        Return a snapshot of the pool utilisation.
+
+        Returns:
+            A dict with the keys 'workers', 'busy', 'idle', 'queued' and 'queue size'.
+        """
+        return {
+            'workers': self.workers,
+            'busy': self.busy_workers,
+            'idle': self.idle_connections,
+            'queued': self.queue_depth,
+            'queue size': self.request_queue_size,
+        }
+
+    def process_request(self, request, client_address):
+        """queue the connection for the worker pool, blocks while the queue is full"""
+        self._queue.put((request, client_address, None))
+
+    def park(self, handler) -> bool:
+        """
+        Release the worker of an idle keep-alive connection.
+
+        Called by handler.handle between two requests, when no further input is buffered.
+        If True is returned, handle must return without closing the connection (the handler
+        skips finish). The handler's handle is called again in a worker once the connection
+        is readable, or finish is called and the connection closed after handler.timeout
+        seconds without a request.
+
+        Returns:
+            False if the server is closing, the handler has to keep serving the connection then.
+        """
+        if self._closing:
+            return False
+        self._local.parked = handler
+        return True
+
+    def shutdown_request(self, request):
+        # the connection of a parked handler stays open
+        if getattr(self._local, 'parked', None) is None:
+            super().shutdown_request(request)
+
+    def _resume(self, handler):
+        try:
+            handler.handle()
+        finally:
+            handler.finish()
+
+    def _close_idle(self, handler):
+        handler.parked = False
+        try:
+            handler.finish()
+        except OSError:
+            pass
+        super().shutdown_request(handler.request)
+
+    def _watch_idle(self):
+        while not self._closing:
+            ready = self._idle.select(timeout=0.5)
+            now = monotonic()
+            with self._idle_lock:
+                for key, _ in ready:
+                    self._idle.unregister(key.fileobj)
+                expired = [key for key in self._idle.get_map().values() if key.data[1] <= now]
+                for key in expired:
+                    self._idle.unregister(key.fileobj)
+            for key in expired:
+                self._close_idle(key.data[0])
+            for key, _ in ready:
+                handler = key.data[0]
+                self._queue.put((handler.request, handler.client_address, handler))
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                request, client_address, handler = item
+                with self._busy_lock:
+                    self._busy += 1
+                self._local.parked = None
+                try:
+                    if handler is None:
+                        self.finish_request(request, client_address)
+                    else:
+                        self._resume(handler)
+                except Exception:
+                    self._local.parked = None
+                    self.handle_error(request, client_address)
+                finally:
+                    parked, self._local.parked = self._local.parked, None
+                    if parked is None:
+                        self.shutdown_request(request)
+                    else:
+                        timeout = parked.timeout if parked.timeout is not None else 0
+                        with self._idle_lock:
+                            self._idle.register(parked.connection, selectors.EVENT_READ, (parked, monotonic() + timeout))
+                    with self._busy_lock:
+                        self._busy -= 1
+            finally:
+                self._queue.task_done()
+
+    def server_close(self, timeout: float = 5.0):
+        """
+        Close the listening socket and the idle connections, and stop the workers once the
+        queue is drained, waiting at most timeout seconds.
+        """
+        super().server_close()
+        self._closing = True
+        self._idle_thread.join()
+        for _ in self._threads:
+            self._queue.put(None)
+        deadline = monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - monotonic()))
+        self._threads = []
+        with self._idle_lock:
+            idle = list(self._idle.get_map().values())
+            for key in idle:
+                self._idle.unregister(key.fileobj)
+        for key in idle:
+            self._close_idle(key.data[0])
@@ -0,0 +1,177 @@
+import os
+import ssl
+import sys
+import threading
+from time import monotonic
+
+
+class ServerTLS:
+    """
+    TLS setup of a server: the SSLContext, reloading of the certificate and handshake counters.
+
+    The context returned by context stays the same for the lifetime of the object. Its
+    session ticket keys are generated once, so create the object before the workers are
+    forked and returning clients can resume their sessions from tickets with every worker.
+    The session ID cache of OpenSSL is not shared, it is per process, so clients resuming
+    by session ID (TLS 1.2 without tickets) only succeed with the worker they used before.
+    When the certificate or key file changes, a new context with the same options is built
+    and selected for new handshakes from the SNI callback, without a restart and without
+    invalidating the issued tickets. If the new files can not be loaded, the old
+    certificate stays in use.
+
+    Args:
+        certfile (str): the certificate chain in PEM format.
+        keyfile (str): the private key, None if it is part of certfile.
+        ciphers (str): OpenSSL cipher list for TLS 1.2, None keeps the defaults.
+        ecdh_curve (str): the curve for ECDH key exchange in TLS 1.2, e.g. 'prime256v1'.
+        alpn (tuple): protocols advertised with ALPN, in order of preference.
+        session_tickets (int): the number of TLS 1.3 session tickets sent after a full
+            handshake, 0 disables session tickets for all protocol versions.
+        handshake_timeout (float): seconds a client gets to complete the handshake.
+        reload_interval (float): seconds between two checks of the certificate files.
+    """
+    def __init__(self, certfile: str, keyfile: str = None, *, ciphers: str = None, ecdh_curve: str = None,
+                 alpn: tuple = ('http/1.1',), session_tickets: int = 2, handshake_timeout: float = 10,
+                 reload_interval: float = 5):
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.ciphers = ciphers
+        self.ecdh_curve = ecdh_curve
+        self.alpn = tuple(alpn)
+        self.session_tickets = int(session_tickets)
+        self.handshake_timeout = handshake_timeout
+        self.reload_interval = reload_interval
+        self.full_handshakes = 0
+        self.resumed_handshakes = 0
+        self.failed_handshakes = 0
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._files = self._stat_files()
+        self._next_check = monotonic() + reload_interval
+        self.context = self._build()
+        self.context.sni_callback = self._select_certificate
+        self._current = self.context
+
+    def _build(self) -> ssl.SSLContext:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.options |= ssl.OP_CIPHER_SERVER_PREFERENCE
+        context.load_cert_chain(self.certfile, keyfile=self.keyfile)
+        if self.ciphers:
+            context.set_ciphers(self.ciphers)
+        if self.ecdh_curve:
+            context.set_ecdh_curve(self.ecdh_curve)
+        if self.alpn:
+            context.set_alpn_protocols(self.alpn)
+        if self.session_tickets > 0:
+            context.num_tickets = self.session_tickets
+        else:
+            context.options |= ssl.OP_NO_TICKET
+            context.num_tickets = 0
+        return context
+
+    def _stat_files(self) -> tuple:
+        files = []
+        for path in (self.certfile, self.keyfile):
+            try:
+                files.append(os.stat(path).st_mtime_ns if path else None)
+            except OSError:
+                files.append(None)
+        return tuple(files)
+
+    def reload_if_changed(self) -> bool:
+        """
+        Load the certificate again if its files changed, at most once per reload_interval.
+
+        Returns:
+            True if a new certificate is used from now on.
+        """
+        now = monotonic()
+        if now < self._next_check:
+            return False
+        with self._lock:
+            if now < self._next_check:
+                return False
+            self._next_check = now + self.reload_interval
+            files = self._stat_files()
+            if files == self._files:
+                return False
+            self._files = files
+            try:
+                context = self._build()
+            except (OSError, ValueError) as e:
+                print("WARNING unable to reload the TLS certificate, keeping the current one:", e, file=sys.stderr)
+                return False
+            self._current = context
+            self.reloads += 1
+            return True
+
+    def _select_certificate(self, ssl_object, server_name, context):
+        # the session cache and ticket keys stay those of self.context, only the certificate changes
+        self.reload_if_changed()
+        if self._current is not context:
+            ssl_object.context = self._current
+
+    def count(self, ssl_object):
+        """count a completed handshake as full or resumed"""
+        with self._lock:
+            if ssl_object.session_reused:
+                self.resumed_handshakes += 1
+            else:
+                self.full_handshakes += 1
+
+    def wrap(self, connection) -> ssl.SSLSocket:
+        """
+        Do the server side handshake on an accepted connection, within handshake_timeout seconds.
+
+        Raises:
+            OSError: if the handshake failed or timed out, the connection is closed then.
+        """
+        timeout = connection.gettimeout()
+        connection.settimeout(self.handshake_timeout)
+        tls_connection = self.context.wrap_socket(connection, server_side=True, do_handshake_on_connect=False)
+        try:
+            tls_connection.do_handshake()
+        except OSError:
+            with self._lock:
+                self.failed_handshakes += 1
+            tls_connection.close()
+            raise
+        tls_connection.settimeout(timeout)
+        self.count(tls_connection)
+        return tls_connection
+
+    def install(self, httpd):
+        """
+        Serve TLS on a socketserver based server (HTTPServer, ThreadPoolHTTPServer).
+
+        The handshake of each connection happens in finish_request, i.e. in the thread
+        handling the connection instead of the accept loop, so slow or stalled handshakes
+        do not hold up other clients. Failed handshakes close the connection silently.
+        """
+        finish_request = httpd.finish_request
+
+        def finish_tls_request(request, client_address):
+            try:
+                connection = self.wrap(request)
+            except OSError:
+                return
+            try:
+                finish_request(connection, client_address)
+            finally:
+                httpd.shutdown_request(connection)
+        httpd.finish_request = finish_tls_request
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            A dict with the number of 'full handshakes', 'resumed handshakes', 'failed handshakes',
+            certificate 'reloads' and the 'session cache' statistics of OpenSSL for this process.
+            The probes of the supervisor resume their sessions and count as resumed handshakes.
+        """
+        return {
+            'full handshakes': self.full_handshakes,
+            'resumed handshakes': self.resumed_handshakes,
+            'failed handshakes': self.failed_handshakes,
+            'reloads': self.reloads,
+            'session cache': self.context.session_stats(),
+        }